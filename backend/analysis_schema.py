@@ -0,0 +1,78 @@
+import json
+from dataclasses import dataclass
+
+DEPARTMENTS = ["HR", "IT", "Finance", "Operations", "Legal", "Safety & Security", "Procurement"]
+PRIORITIES = ["High", "Medium", "Low"]
+
+
+def _string_schema(enum=None) -> dict:
+    if enum is None:
+        return {"type": "STRING"}
+    return {"type": "STRING", "format": "enum", "enum": list(enum)}
+
+
+# Gemini emits structured-output properties in alphabetical order, and the google-generativeai SDK has no field
+# for propertyOrdering. The summary is therefore requested as "a_summary", which sorts first, so a streamed
+# answer starts with it; AnalysisResult maps it back to "summary".
+SUMMARY_WIRE_FIELD = "a_summary"
+
+# Response schemas for Gemini structured output; department and priority are constrained to the known values.
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        SUMMARY_WIRE_FIELD: _string_schema(),
+        "department": _string_schema(DEPARTMENTS),
+        "priority": _string_schema(PRIORITIES),
+        "action_required": _string_schema(),
+    },
+    "required": [SUMMARY_WIRE_FIELD, "department", "priority", "action_required"],
+}
+SUMMARY_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        SUMMARY_WIRE_FIELD: _string_schema(),
+        "action_required": _string_schema(),
+    },
+    "required": [SUMMARY_WIRE_FIELD, "action_required"],
+}
+
+
+def generation_config(schema: dict) -> dict:
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+@dataclass
+class AnalysisResult:
+    """A validated model answer. Department and priority are only optional for summary-only requests."""
+
+    summary: str
+    action_required: str
+    department: str = "Unknown"
+    priority: str = "Medium"
+
+    @classmethod
+    def from_json(cls, text: str, classified: bool = True) -> "AnalysisResult":
+        """Parses and validates a structured-output response; raises ValueError if it does not match the schema."""
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("response is not a JSON object")
+
+        fields = [SUMMARY_WIRE_FIELD, "action_required"] + (["department", "priority"] if classified else [])
+        for field in fields:
+            if not isinstance(data.get(field), str):
+                raise ValueError(f"missing or non-string field '{field}'")
+        if classified and data["department"] not in DEPARTMENTS:
+            raise ValueError(f"unknown department '{data['department']}'")
+        if classified and data["priority"] not in PRIORITIES:
+            raise ValueError(f"unknown priority '{data['priority']}'")
+        values = {field: data[field] for field in fields}
+        values["summary"] = values.pop(SUMMARY_WIRE_FIELD)
+        return cls(**values)
+
+    def to_dict(self) -> dict:
+        return {
+            "summary": self.summary,
+            "department": self.department,
+            "priority": self.priority,
+            "action_required": self.action_required,
+        }
@@ -1,13 +1,39 @@
 import os
+import asyncio
 import mimetypes
 from PIL import Image
-import pypdf
 import google.generativeai as genai
 from dotenv import load_dotenv
-import json
 import base64
+import json
+import re
 from io import BytesIO
-import pdf2image
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, Union
+
+from analysis_schema import (
+    ANALYSIS_RESPONSE_SCHEMA,
+    SUMMARY_RESPONSE_SCHEMA,
+    SUMMARY_WIRE_FIELD,
+    AnalysisResult,
+    generation_config,
+)
+from image_prep import (
+    IMAGE_GRAYSCALE_MAX_SATURATION,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_MAX_DIMENSION,
+    IMAGE_PREPROCESS_ENABLED,
+    encode_image,
+    prepare_image,
+)
+from keyword_classifier import keyword_classifier, local_result
+from metrics import ANALYSIS_RESULTS, count_bytes, stage_timer
+from pdf_raster import SCANNED_PDF_DPI, SCANNED_PDF_MAX_DIMENSION, SCANNED_PDF_MAX_PAGES, iter_pdf_page_images
+from pdf_text import iter_pdf_pages
+from result_cache import get_result_cache, make_cache_key
+from rate_limiter import get_gemini_limiter, is_rate_limit_error
 
 # Load environment variables
 ab_env_path = os.path.join(os.path.dirname(__file__), "ab.env")
@@ -20,124 +46,627 @@ else:
 GEN_AI_API_KEY = os.environ.get("GEN_AI_API_KEY")
 genai.configure(api_key=GEN_AI_API_KEY)
 
+# Named model configurations selectable per request; "flash" is the default
+MODEL_CONFIGS = {
+    "flash": {
+        "model_name": os.environ.get("GEMINI_FLASH_MODEL", 'gemini-1.5-flash-latest'),
+    },
+    "pro": {
+        "model_name": os.environ.get("GEMINI_PRO_MODEL", 'gemini-1.5-pro-latest'),
+    },
+}
+DEFAULT_MODEL_CONFIG = os.environ.get("GEMINI_DEFAULT_MODEL", "flash")
+
+# Updated and more specific prompt for KMRL. Passed to the model as its system_instruction instead of being
+# repeated in every request's contents; requests carry only the short REQUEST_PROMPT and any user instructions.
+BASE_PROMPT = (
+    "You are an AI assistant for Kochi Metro Rail Limited (KMRL). Analyze the provided document/image. "
+    "Your tasks are to: "
+    "1. Provide a concise summary of the document's content. "
+    "2. Detect the most relevant department (HR, IT, Finance, Operations, Legal, Safety & Security, Procurement). "
+    "3. Assign a priority level (High, Medium, Low). "
+    "4. Suggest a clear, actionable next step as 'action_required'.\n\n"
+    "**Priority Rules:**\n"
+    "- **High Priority:** MUST be assigned for documents containing keywords related to: "
+    "  - **Safety/Security:** 'accident', 'derailment', 'collision', 'fire', 'safety audit', 'security breach', 'unavoidable delays', 'service disruption'. "
+    "  - **Legal:** 'legal notice', 'lawsuit', 'court order', 'compliance violation'. "
+    "  - **Financial:** 'audit objection', 'financial loss', 'fraud', 'tender irregularity'. "
+    "  - **Urgent Operations:** 'emergency maintenance', 'system failure', 'power outage', 'signal failure'.\n"
+    "- **Medium Priority:** Assign for standard operational, financial, or HR reports.\n"
+    "- **Low Priority:** Assign for general correspondence, newsletters, or non-critical updates.\n\n"
+    "Return the response ONLY in JSON format with 'a_summary' (the summary), 'department', 'priority', and 'action_required' fields."
+)
+# The per-request part of the prompt, sent ahead of the document
+REQUEST_PROMPT = "Analyze the following document."
+
+
+# Documents whose extracted text is longer than LONG_DOCUMENT_THRESHOLD_TOKENS are summarized map-reduce style:
+# the text is split into chunks of at most LONG_DOCUMENT_CHUNK_TOKENS, the chunks are summarized concurrently,
+# and the chunk summaries are reduced into the final JSON answer
+LONG_DOCUMENT_THRESHOLD_TOKENS = int(os.environ.get("LONG_DOCUMENT_THRESHOLD_TOKENS", 30000))
+LONG_DOCUMENT_CHUNK_TOKENS = int(os.environ.get("LONG_DOCUMENT_CHUNK_TOKENS", 8000))
+LONG_DOCUMENT_MAP_CONCURRENCY = int(os.environ.get("LONG_DOCUMENT_MAP_CONCURRENCY", 4))
+# PDF text extraction stops after this many (estimated) tokens; 0 extracts every page
+PDF_TEXT_MAX_TOKENS = int(os.environ.get("PDF_TEXT_MAX_TOKENS", 200000))
+
+CHUNK_PROMPT = (
+    "You are an AI assistant for Kochi Metro Rail Limited (KMRL). The text below is one part of a longer document. "
+    "Summarize this part concisely in plain text. Keep every fact that bears on which department the document "
+    "belongs to, how urgent it is, and what action it requires, and quote verbatim any mention of accidents, "
+    "safety or security incidents, legal notices, court orders, audit objections, fraud, tender irregularities, "
+    "emergency maintenance, system failures, power outages or signal failures."
+)
+CHUNK_REQUEST_PROMPT = "Summarize the following part."
+SCANNED_PDF_NOTE = "The document is a scanned PDF; its first {pages} page(s) follow as images, in page order."
+REDUCE_INSTRUCTIONS = (
+    "The document was too long to analyze in one request. "
+    "Below are summaries of its consecutive parts, in order; analyze the document as a whole from them."
+)
+
+
+# How the local keyword classifier is used for documents with extractable text:
+#   off          - not run
+#   merge        - Gemini analyzes as usual; high-priority keywords force priority High (the default)
+#   summary_only - on a confident match, department and priority come from the classifier and Gemini only summarizes
+#   skip         - on a confident match, Gemini is not called; the summary is an extract of the document
+PRECLASSIFY_MODES = ("off", "merge", "summary_only", "skip")
+PRECLASSIFY_MODE = os.environ.get("PRECLASSIFY_MODE", "merge").lower()
+if PRECLASSIFY_MODE not in PRECLASSIFY_MODES:
+    PRECLASSIFY_MODE = "merge"
+# A match is confident when it includes a high-priority keyword, or when the winning department's distinct
+# keywords reach this score; a lone generic word such as "station" or "payment" never replaces the model
+PRECLASSIFY_MIN_SCORE = int(os.environ.get("PRECLASSIFY_MIN_SCORE", 3))
 
-def generate_universal_caption(file_data: str, filename: str, custom_prompt: str | None = None):
+SUMMARY_PROMPT = (
+    "You are an AI assistant for Kochi Metro Rail Limited (KMRL). Analyze the provided document. "
+    "Provide a concise summary of the document's content and suggest a clear, actionable next step as 'action_required'. "
+    "Return the response ONLY in JSON format with 'a_summary' (the summary) and 'action_required' fields."
+)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(config_name: str | None = None, system_instruction: str = BASE_PROMPT) -> genai.GenerativeModel:
+    """
+    Returns the GenerativeModel for a named configuration and system instruction (one of the fixed prompts),
+    built once and reused by every call.
+    """
+    key = (config_name or DEFAULT_MODEL_CONFIG, system_instruction)
+    model = _models.get(key)
+    if model is None:
+        config = MODEL_CONFIGS[key[0]]
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = _models[key] = genai.GenerativeModel(config["model_name"], generation_config=config.get("generation_config"),
+                                                             system_instruction=system_instruction)
+    return model
+
+
+@lru_cache(maxsize=256)
+def build_prompt(custom_prompt: str | None = None, base_prompt: str = REQUEST_PROMPT) -> str:
+    """The request prompt plus optional user instructions; rendered once per distinct custom prompt."""
+    return f"{base_prompt}\n\nAdditional instructions from user: {custom_prompt}" if custom_prompt else base_prompt
+
+
+def generate_universal_caption(file_data: str, filename: str, custom_prompt: str | None = None, model: str | None = None):
     """
     Generate AI summary and detect department for uploaded file.
-    Accepts a base64 data URL string and original filename.
+    Accepts a base64 data URL string and original filename; see generate_caption_from_bytes.
+    """
+    try:
+        file_bytes = base64.b64decode(file_data.split(',')[1])
+    except Exception as e:
+        return {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+    return generate_caption_from_bytes(file_bytes, filename, custom_prompt, model=model)
+
+
+def generate_caption_from_bytes(file_data: Union[bytes, bytearray, memoryview, BinaryIO], filename: str,
+                                custom_prompt: str | None = None, mime_type: str | None = None, model: str | None = None):
+    """
+    Generate AI summary and detect department for raw file content and its original filename.
+    file_data may be bytes, a memoryview, or a binary file object (seekable ones are read in place).
+    mime_type overrides the type guessed from filename; model names an entry in MODEL_CONFIGS (default flash).
     Returns dict with keys: summary, department, priority, action_required or error.
+    Successful results are cached by content hash, prompt and model, so repeat uploads skip Gemini.
     """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        mime_type, _ = mimetypes.guess_type(filename)
+        request = _prepare_request(file_data, filename, custom_prompt, mime_type, model)
+        if 'result' in request:
+            return request['result']
+
+        contents = _build_model_input(request)
+        if isinstance(contents, dict):
+            return _count_result(contents, "error")
+        contents = _preclassify(request, contents)
+        if isinstance(contents, dict):
+            return _finish_request(request, contents, "local")
+
+        gemini = get_model(request['model_config'], request['system_instruction'])
+        try:
+            chunks = _long_document_chunks(contents)
+            if chunks:
+                contents = _reduce_input(request, _summarize_chunks(request, chunks))
+            config = generation_config(request['schema'])
+            response = get_gemini_limiter().call(lambda: _generate(gemini, contents, generation_config=config),
+                                                 _estimate_tokens(contents, request['system_instruction']))
+        except Exception as e:
+            return _model_error(request, e)
+        return _finish_request(request, _apply_local_classification(request, _process_response(response, request)))
+
+    except Exception as e:
+        return {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+
+
+async def generate_universal_caption_async(file_data: str, filename: str, custom_prompt: str | None = None, model: str | None = None):
+    """Async variant of generate_universal_caption."""
+    try:
+        file_bytes = base64.b64decode(file_data.split(',')[1])
+    except Exception as e:
+        return {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+    return await generate_caption_from_bytes_async(file_bytes, filename, custom_prompt, model=model)
+
 
-        if mime_type is None:
-            return {
-                "error": f"Could not determine the file type for {filename}",
-                "summary": "",
-                "department": "",
-                "priority": "Low",
-                "action_required": "N/A"
-            }
-
-        main_type = mime_type.split('/')[0]
-
-        # Updated and more specific prompt for KMRL
-        base_prompt = (
-            "You are an AI assistant for Kochi Metro Rail Limited (KMRL). Analyze the provided document/image. "
-            "Your tasks are to: "
-            "1. Provide a concise summary of the document's content. "
-            "2. Detect the most relevant department (HR, IT, Finance, Operations, Legal, Safety & Security, Procurement). "
-            "3. Assign a priority level (High, Medium, Low). "
-            "4. Suggest a clear, actionable next step as 'action_required'.\n\n"
-            "**Priority Rules:**\n"
-            "- **High Priority:** MUST be assigned for documents containing keywords related to: "
-            "  - **Safety/Security:** 'accident', 'derailment', 'collision', 'fire', 'safety audit', 'security breach', 'unavoidable delays', 'service disruption'. "
-            "  - **Legal:** 'legal notice', 'lawsuit', 'court order', 'compliance violation'. "
-            "  - **Financial:** 'audit objection', 'financial loss', 'fraud', 'tender irregularity'. "
-            "  - **Urgent Operations:** 'emergency maintenance', 'system failure', 'power outage', 'signal failure'.\n"
-            "- **Medium Priority:** Assign for standard operational, financial, or HR reports.\n"
-            "- **Low Priority:** Assign for general correspondence, newsletters, or non-critical updates.\n\n"
-            "Return the response ONLY in JSON format with 'summary', 'department', 'priority', and 'action_required' fields."
-        )
-
-        prompt = f"{base_prompt}\n\nAdditional instructions from user: {custom_prompt}" if custom_prompt else base_prompt
-
-        def process_response(response):
+async def generate_caption_from_bytes_async(file_data: Union[bytes, bytearray, memoryview, BinaryIO], filename: str,
+                                            custom_prompt: str | None = None, mime_type: str | None = None,
+                                            model: str | None = None):
+    """
+    Async variant of generate_caption_from_bytes. The Gemini call uses the SDK's generate_content_async, so one
+    event loop can keep many requests in flight; hashing, PDF extraction, rasterization and keyword classification
+    run in worker threads.
+    """
+    try:
+        request = await asyncio.to_thread(_prepare_request, file_data, filename, custom_prompt, mime_type, model)
+        if 'result' in request:
+            return request['result']
+
+        contents = await asyncio.to_thread(_build_model_input, request)
+        if isinstance(contents, dict):
+            return _count_result(contents, "error")
+        contents = await asyncio.to_thread(_preclassify, request, contents)
+        if isinstance(contents, dict):
+            return await asyncio.to_thread(_finish_request, request, contents, "local")
+
+        gemini = get_model(request['model_config'], request['system_instruction'])
+        try:
+            chunks = _long_document_chunks(contents)
+            if chunks:
+                contents = _reduce_input(request, await _summarize_chunks_async(request, chunks))
+            config = generation_config(request['schema'])
+            response = await get_gemini_limiter().acall(lambda: _generate_async(gemini, contents, generation_config=config),
+                                                        _estimate_tokens(contents, request['system_instruction']))
+        except Exception as e:
+            return _model_error(request, e)
+        result = _apply_local_classification(request, _process_response(response, request))
+        return await asyncio.to_thread(_finish_request, request, result)
+
+    except Exception as e:
+        return {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+
+
+def stream_universal_caption(file_data: str, filename: str, custom_prompt: str | None = None, model: str | None = None):
+    """Streaming variant of generate_universal_caption; see stream_caption_from_bytes."""
+    try:
+        file_bytes = base64.b64decode(file_data.split(',')[1])
+    except Exception as e:
+        yield "result", {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+        return
+    yield from stream_caption_from_bytes(file_bytes, filename, custom_prompt, model=model)
+
+
+def stream_caption_from_bytes(file_data: Union[bytes, bytearray, memoryview, BinaryIO], filename: str,
+                              custom_prompt: str | None = None, mime_type: str | None = None, model: str | None = None):
+    """
+    Streaming variant of generate_caption_from_bytes. Yields ("summary", text) events carrying the summary
+    as it is generated, then exactly one ("result", dict) event with the same dict the non-streaming call
+    returns. Answers that need no streamed model call (cache hits, local classification) yield their
+    whole summary as a single event.
+    """
+    try:
+        request = _prepare_request(file_data, filename, custom_prompt, mime_type, model)
+        if 'result' in request:
+            yield from _whole_result_events(request['result'])
+            return
+
+        contents = _build_model_input(request)
+        if isinstance(contents, dict):
+            yield "result", _count_result(contents, "error")
+            return
+        contents = _preclassify(request, contents)
+        if isinstance(contents, dict):
+            yield from _whole_result_events(_finish_request(request, contents, "local"))
+            return
+
+        gemini = get_model(request['model_config'], request['system_instruction'])
+        try:
+            chunks = _long_document_chunks(contents)
+            if chunks:
+                contents = _reduce_input(request, _summarize_chunks(request, chunks))
+            config = generation_config(request['schema'])
+            # The SDK reads the first chunk before returning, so rate limiting on the initial call is still retried
+            response = get_gemini_limiter().call(
+                lambda: _generate(gemini, contents, generation_config=config, stream=True),
+                _estimate_tokens(contents, request['system_instruction']))
+            extractor = _SummaryExtractor()
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                delta = extractor.feed(text)
+                if delta:
+                    yield "summary", delta
+        except Exception as e:
+            yield "result", _model_error(request, e)
+            return
+        yield "result", _finish_request(request, _apply_local_classification(request, _process_response(response, request)))
+
+    except Exception as e:
+        yield "result", {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+
+
+def _whole_result_events(result: dict):
+    if 'error' not in result and result.get('summary'):
+        yield "summary", result['summary']
+    yield "result", result
+
+
+class _SummaryExtractor:
+    """
+    Pulls the summary string (the SUMMARY_WIRE_FIELD property) out of a JSON object that arrives in pieces, returning newly decoded
+    text after each piece. Escape sequences split across pieces are held back until complete, and a
+    \\u escape for a high surrogate is held back until its low surrogate arrives, so the pair decodes
+    to one character. The key is matched wherever it appears; Gemini generates it first.
+    """
+
+    _START = re.compile(rf'"{SUMMARY_WIRE_FIELD}"\s*:\s*"')
+    _HIGH_SURROGATE = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}')
+    _LOW_SURROGATE = re.compile(r'\\u[dD][c-fC-F][0-9a-fA-F]{2}')
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None
+        self._done = False
+
+    def feed(self, text: str) -> str:
+        if self._done:
+            return ""
+        self._buffer += text
+        if self._pos is None:
+            match = self._START.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        out = []
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                self._done = True
+                break
+            if char != '\\':
+                out.append(char)
+                pos += 1
+                continue
+            end = pos + (6 if buffer[pos + 1:pos + 2] == 'u' else 2)
+            if end > len(buffer):
+                break
+            if self._HIGH_SURROGATE.fullmatch(buffer, pos, end):
+                low = buffer[end:end + 6]
+                if len(low) < 6 and '\\u'.startswith(low[:2]):
+                    # The low half may still be on its way
+                    break
+                if self._LOW_SURROGATE.fullmatch(low):
+                    end += 6
             try:
-                # Clean the response text to ensure it's valid JSON
-                clean_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-                result = json.loads(clean_text)
-                return {
-                    "summary": result.get("summary", response.text),
-                    "department": result.get("department", "Unknown"),
-                    "priority": result.get("priority", "Medium"),
-                    "action_required": result.get("action_required", "Review required")
-                }
-            except json.JSONDecodeError:
-                # Fallback if the response is not clean JSON
-                text = response.text
-                departments = ["HR", "IT", "Finance", "Operations", "Legal", "Safety & Security", "Procurement"]
-                priorities = ["High", "Medium", "Low"]
-                detected_dept = "Unknown"
-                detected_priority = "Medium"
-
-                for dept in departments:
-                    if dept.lower() in text.lower():
-                        detected_dept = dept
-                        break
-                for priority in priorities:
-                    if priority.lower() in text.lower():
-                        detected_priority = priority
-                        break
-                
-                return {
-                    "summary": text,
-                    "department": detected_dept,
-                    "priority": detected_priority,
-                    "action_required": "Review and categorize manually"
-                }
-
-        if main_type == 'image':
-            image_data = base64.b64decode(file_data.split(',')[1])
-            img = Image.open(BytesIO(image_data))
-            response = model.generate_content([prompt, img])
-            return process_response(response)
-
-        elif mime_type == 'application/pdf':
-            pdf_data = base64.b64decode(file_data.split(',')[1])
+                out.append(json.loads(f'"{buffer[pos:end]}"'))
+            except ValueError:
+                # A malformed escape; pass it through undecoded
+                out.append(buffer[pos:end])
+            pos = end
+        self._pos = pos
+        return "".join(out)
+
+
+def _prepare_request(file_data, filename: str, custom_prompt: str | None, mime_type: str | None, model: str | None) -> dict:
+    """
+    Resolves model configuration, file type and prompt and checks the result cache.
+    Returns {"result": ...} when the answer is already known (error or cache hit), otherwise the request context.
+    """
+    model_config = model or DEFAULT_MODEL_CONFIG
+    if model_config not in MODEL_CONFIGS:
+        return {"result": {"error": f"Unknown model configuration '{model_config}'. Choose one of: {', '.join(MODEL_CONFIGS)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}}
+
+    if mime_type is None:
+        mime_type, _ = mimetypes.guess_type(filename)
+
+    if mime_type is None:
+        return {"result": {
+            "error": f"Could not determine the file type for {filename}",
+            "summary": "",
+            "department": "",
+            "priority": "Low",
+            "action_required": "N/A"
+        }}
+
+    main_type = mime_type.split('/')[0]
+
+    prompt = build_prompt(custom_prompt)
+
+    if main_type not in ('image', 'text') and mime_type != 'application/pdf':
+        return {"result": {"error": f"Unsupported file type '{mime_type}'.", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}}
+
+    stream = _as_stream(file_data)
+
+    cache = get_result_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(stream, mime_type, f"{BASE_PROMPT}\n\n{prompt}", MODEL_CONFIGS[model_config]["model_name"],
+                                   _cache_variant())
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return {"result": _count_result(cached, "cache_hit")}
+
+    return {
+        "stream": stream,
+        "mime_type": mime_type,
+        "main_type": main_type,
+        "prompt": prompt,
+        "custom_prompt": custom_prompt,
+        "system_instruction": BASE_PROMPT,
+        "model_config": model_config,
+        "cache": cache,
+        "cache_key": cache_key,
+        "scanned_pdf": False,
+        "local": None,
+        "schema": ANALYSIS_RESPONSE_SCHEMA,
+    }
+
+
+@lru_cache(maxsize=1)
+def _cache_variant() -> str:
+    """
+    Settings that change what the model is shown (page limits, rasterization, image preprocessing,
+    long-document chunking) or how the answer is built (pre-classification mode and keyword rules).
+    """
+    settings = [
+        f"pdf_text_max_tokens={PDF_TEXT_MAX_TOKENS}",
+        f"scanned_pdf={SCANNED_PDF_MAX_PAGES},{SCANNED_PDF_DPI},{SCANNED_PDF_MAX_DIMENSION}",
+        f"image={IMAGE_PREPROCESS_ENABLED},{IMAGE_MAX_DIMENSION},{IMAGE_JPEG_QUALITY},{IMAGE_GRAYSCALE_MAX_SATURATION}",
+        f"long_document={LONG_DOCUMENT_THRESHOLD_TOKENS},{LONG_DOCUMENT_CHUNK_TOKENS}",
+        f"preclassify={PRECLASSIFY_MODE}",
+    ]
+    if PRECLASSIFY_MODE != "off":
+        settings.append(f"rules={keyword_classifier.version},{PRECLASSIFY_MIN_SCORE}")
+    return ";".join(settings)
+
+
+def _finish_request(request: dict, result: dict, source: str = "model") -> dict:
+    """Stores a successful result in the cache and returns it."""
+    if request['cache_key'] and 'error' not in result:
+        request['cache'].set(request['cache_key'], result)
+    return _count_result(result, "error" if 'error' in result else source)
+
+
+def _count_result(result: dict, source: str) -> dict:
+    ANALYSIS_RESULTS.inc(result=source)
+    return result
+
+
+def _model_error(request: dict, e: Exception) -> dict:
+    if is_rate_limit_error(e):
+        # Quota still exhausted after all retries: flag it so callers retry later instead of storing this as a summary
+        result = {"error": f"Gemini rate limit exceeded: {str(e)}", "retryable": True, "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+    elif request['scanned_pdf']:
+        result = {"error": f"Could not process image-only PDF: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "Manual review needed"}
+    else:
+        result = {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+    local = request['local']
+    if local and local['keywords']:
+        # The model is unavailable, but the keyword classification still flags what needs attention
+        result["department"] = local["department"]
+        result["priority"] = local["priority"]
+    return _count_result(result, "error")
+
+
+def _preclassify(request: dict, contents: list):
+    """
+    Runs the keyword classifier over the document text according to PRECLASSIFY_MODE.
+    Returns a finished result when the model call can be skipped, otherwise the contents to send.
+    """
+    if PRECLASSIFY_MODE == "off" or len(contents) != 2 or not isinstance(contents[1], str):
+        return contents
+    local = keyword_classifier.classify(contents[1])
+    request['local'] = local
+    if not _is_confident(local):
+        return contents
+    if PRECLASSIFY_MODE == "skip":
+        return local_result(contents[1], local)
+    if PRECLASSIFY_MODE == "summary_only":
+        request['system_instruction'] = SUMMARY_PROMPT
+        request['schema'] = SUMMARY_RESPONSE_SCHEMA
+        return contents
+    return contents
+
+
+def _is_confident(local: dict) -> bool:
+    """Whether a keyword classification is strong enough to stand in for the model's (see PRECLASSIFY_MIN_SCORE)."""
+    return bool(local['high_priority_keywords']) or local['score'] >= PRECLASSIFY_MIN_SCORE
+
+
+def _apply_local_classification(request: dict, result: dict) -> dict:
+    local = request['local']
+    if not local or not local['keywords'] or 'error' in result:
+        return result
+    if PRECLASSIFY_MODE == "summary_only" and _is_confident(local):
+        result["department"] = local["department"]
+        result["priority"] = local["priority"]
+    elif local["high_priority_keywords"]:
+        # The prompt's High priority keyword rules are mandatory, so enforce them even if the model missed one
+        result["priority"] = "High"
+    return result
+
+
+# Gemini bills each image as a fixed number of tokens; text is roughly four characters per token
+_IMAGE_TOKENS = 258
+_CHARS_PER_TOKEN = 4
+
+
+def _estimate_tokens(contents: list, system_instruction: str = "") -> int:
+    """Rough input token count used to pace calls against the TPM budget; the system instruction is billed too."""
+    return len(system_instruction) // _CHARS_PER_TOKEN + sum(
+        len(part) // _CHARS_PER_TOKEN if isinstance(part, str) else _IMAGE_TOKENS for part in contents)
+
+
+def _long_document_chunks(contents: list) -> list | None:
+    """Returns the text chunks to summarize separately when the document text is over the long-document threshold."""
+    if len(contents) != 2 or not isinstance(contents[1], str):
+        return None
+    if len(contents[1]) // _CHARS_PER_TOKEN <= LONG_DOCUMENT_THRESHOLD_TOKENS:
+        return None
+    return _split_text(contents[1], LONG_DOCUMENT_CHUNK_TOKENS)
+
+
+def _split_text(text: str, max_tokens: int) -> list:
+    """Splits text into chunks of at most max_tokens (estimated), breaking at line ends and hard-splitting longer lines."""
+    limit = max(1, max_tokens * _CHARS_PER_TOKEN)
+    chunks = []
+    current = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        for start in range(0, len(line), limit):
+            piece = line[start:start + limit]
+            if current and size + len(piece) > limit:
+                chunks.append("".join(current))
+                current = []
+                size = 0
+            current.append(piece)
+            size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _chunk_input(request: dict, index: int, total: int, chunk: str) -> list:
+    return [build_prompt(request['custom_prompt'], CHUNK_REQUEST_PROMPT), f"Part {index} of {total}:\n\n{chunk}"]
+
+
+def _reduce_input(request: dict, summaries: list) -> list:
+    parts = "\n\n".join(f"Part {i} of {len(summaries)}:\n{summary}" for i, summary in enumerate(summaries, 1))
+    return [request['prompt'], f"{REDUCE_INSTRUCTIONS}\n\n{parts}"]
+
+
+def _summarize_chunks(request: dict, chunks: list) -> list:
+    """Map step: summarizes every chunk, up to LONG_DOCUMENT_MAP_CONCURRENCY at once; summaries keep chunk order."""
+    gemini = get_model(request['model_config'], CHUNK_PROMPT)
+    inputs = [_chunk_input(request, i, len(chunks), chunk) for i, chunk in enumerate(chunks, 1)]
+
+    def summarize(contents):
+        return get_gemini_limiter().call(lambda: _generate(gemini, contents), _estimate_tokens(contents, CHUNK_PROMPT)).text
+
+    with ThreadPoolExecutor(max_workers=max(1, min(LONG_DOCUMENT_MAP_CONCURRENCY, len(inputs)))) as pool:
+        return list(pool.map(summarize, inputs))
+
+
+async def _summarize_chunks_async(request: dict, chunks: list) -> list:
+    """Async variant of _summarize_chunks."""
+    gemini = get_model(request['model_config'], CHUNK_PROMPT)
+    inputs = [_chunk_input(request, i, len(chunks), chunk) for i, chunk in enumerate(chunks, 1)]
+    semaphore = asyncio.Semaphore(max(1, LONG_DOCUMENT_MAP_CONCURRENCY))
+
+    async def summarize(contents):
+        async with semaphore:
+            response = await get_gemini_limiter().acall(lambda: _generate_async(gemini, contents), _estimate_tokens(contents, CHUNK_PROMPT))
+            return response.text
+
+    return list(await asyncio.gather(*(summarize(contents) for contents in inputs)))
+
+
+def _generate(gemini, contents: list, **kwargs):
+    """One Gemini call, timed as the gemini_call stage (for stream=True, until the first chunk arrives)."""
+    with stage_timer("gemini_call"):
+        return gemini.generate_content(contents, **kwargs)
+
+
+async def _generate_async(gemini, contents: list, **kwargs):
+    with stage_timer("gemini_call"):
+        return await gemini.generate_content_async(contents, **kwargs)
+
+
+def _as_stream(file_data: Union[bytes, bytearray, memoryview, BinaryIO]) -> BinaryIO:
+    """
+    Wraps file content in a seekable binary stream without copying it where possible.
+    BytesIO shares the buffer of an immutable bytes object, so a memoryview over whole bytes is unwrapped first.
+    """
+    if hasattr(file_data, 'read'):
+        if getattr(file_data, 'seekable', lambda: False)():
+            return file_data
+        return BytesIO(file_data.read())
+    if isinstance(file_data, memoryview):
+        if isinstance(file_data.obj, bytes) and file_data.contiguous and file_data.nbytes == len(file_data.obj):
+            file_data = file_data.obj
+        else:
+            file_data = file_data.tobytes()
+    return BytesIO(file_data)
+
+
+def _build_model_input(request: dict):
+    """
+    Turns the file into the content list sent to Gemini (prompt plus image or text).
+    Returns an error dict instead when the file cannot be prepared.
+    """
+    stream = request['stream']
+    mime_type = request['mime_type']
+    main_type = request['main_type']
+    prompt = request['prompt']
+
+    if main_type == 'image':
+        if IMAGE_PREPROCESS_ENABLED:
+            return [prompt, prepare_image(stream, mime_type)]
+        img = Image.open(stream)
+        return [prompt, img]
+
+    elif mime_type == 'application/pdf':
+        try:
+            count_bytes("pdf_extract", stream.seek(0, os.SEEK_END))
+            with stage_timer("pdf_extract"):
+                pdf_text = "\n".join(iter_pdf_pages(stream, PDF_TEXT_MAX_TOKENS * _CHARS_PER_TOKEN or None))
+        except Exception:
             pdf_text = ""
-            
+
+        if not pdf_text.strip():
+            request['scanned_pdf'] = True
             try:
-                reader = pypdf.PdfReader(BytesIO(pdf_data))
-                for page in reader.pages:
-                    page_text = page.extract_text() or ""
-                    pdf_text += page_text
-            except Exception:
-                pdf_text = ""
-
-            if not pdf_text.strip():
-                try:
-                    images = pdf2image.convert_from_bytes(pdf_data, first_page=1, last_page=1)
-                    if images:
-                        img = images[0]
-                        response = model.generate_content([prompt, img])
-                        return process_response(response)
-                    else:
-                         return {"error": "Could not convert PDF to image for analysis", "summary": "", "department": "", "priority": "Low", "action_required": "Manual review needed"}
-                except Exception as e:
-                    return {"error": f"Could not process image-only PDF: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "Manual review needed"}
-            
-            response = model.generate_content([prompt, pdf_text])
-            return process_response(response)
-
-        elif main_type == 'text':
-            text_data = base64.b64decode(file_data.split(',')[1]).decode('utf-8')
-            response = model.generate_content([prompt, text_data])
-            return process_response(response)
+                with stage_timer("pdf_rasterize"):
+                    images = list(iter_pdf_page_images(stream))
+                if images:
+                    if IMAGE_PREPROCESS_ENABLED:
+                        images = [encode_image(image) for image in images]
+                    return [prompt, SCANNED_PDF_NOTE.format(pages=len(images)), *images]
+                else:
+                     return {"error": "Could not convert PDF to image for analysis", "summary": "", "department": "", "priority": "Low", "action_required": "Manual review needed"}
+            except Exception as e:
+                return {"error": f"Could not process image-only PDF: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "Manual review needed"}
+        
+        return [prompt, pdf_text]
 
-        else:
-            return {"error": f"Unsupported file type '{mime_type}'.", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+    elif main_type == 'text':
+        text_data = stream.read().decode('utf-8')
+        return [prompt, text_data]
 
-    except Exception as e:
-        return {"error": f"An unexpected error occurred: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
\ No newline at end of file
+    else:
+        return {"error": f"Unsupported file type '{mime_type}'.", "summary": "", "department": "", "priority": "Low", "action_required": "N/A"}
+
+
+def _process_response(response, request: dict) -> dict:
+    """Validates the structured-output answer; a response that does not match the schema is reported as an error."""
+    try:
+        classified = request['schema'] is ANALYSIS_RESPONSE_SCHEMA
+        return AnalysisResult.from_json(response.text, classified=classified).to_dict()
+    except ValueError as e:
+        # Also raised by response.text when the answer was blocked or came back empty
+        return {"error": f"Model returned an invalid analysis: {str(e)}", "summary": "", "department": "", "priority": "Low", "action_required": "Manual review needed"}
@@ -1,6 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
+import json
+import tempfile
 from dotenv import load_dotenv
 
 if os.path.exists(os.path.join(os.path.dirname(__file__), "ab.env")):
@@ -8,20 +10,97 @@ if os.path.exists(os.path.join(os.path.dirname(__file__), "ab.env")):
 else:
     load_dotenv()
 
+from log_setup import configure_logging
+configure_logging()
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-from analyzer import generate_universal_caption
+from analyzer import (
+    generate_caption_from_bytes,
+    generate_caption_from_bytes_async,
+    generate_universal_caption,
+    generate_universal_caption_async,
+    stream_caption_from_bytes,
+    stream_universal_caption,
+)
+from async_engine import async_engine
+from http_session import pool_stats
+from image_prep import preprocess_stats
+from metrics import render_gauges, render_metrics
+from rate_limiter import get_gemini_limiter
 
 try:
     from gmail_service import gmail_bp
+    from gmail_clients import client_stats
     app.register_blueprint(gmail_bp, url_prefix='/api/gmail')
 except Exception as _e:
-    pass
+    def client_stats():
+        return {}
+
+# Uploads larger than this are spooled to a temp file on disk instead of being held in memory
+UPLOAD_SPOOL_MAX_MEMORY = int(os.environ.get("UPLOAD_SPOOL_MAX_MEMORY", 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Batch analysis limits: default/maximum documents analyzed at once, and documents per request
+ANALYZE_BATCH_CONCURRENCY = int(os.environ.get("ANALYZE_BATCH_CONCURRENCY", 8))
+ANALYZE_BATCH_MAX_CONCURRENCY = int(os.environ.get("ANALYZE_BATCH_MAX_CONCURRENCY", 32))
+ANALYZE_BATCH_MAX_DOCUMENTS = int(os.environ.get("ANALYZE_BATCH_MAX_DOCUMENTS", 100))
+
+
+def _analysis_payload(result):
+    return {
+        "success": True,
+        "summary": result['summary'],
+        "department": result['department'],
+        "priority": result.get('priority', 'Medium'),
+        "action_required": result.get('action_required', 'Review required')
+    }
+
+
+def _analysis_response(result):
+    if 'error' in result:
+        # Quota exhausted even after retries: tell the client to try again later
+        return jsonify(result), 429 if result.get('retryable') else 400
+
+    return jsonify(_analysis_payload(result))
+
+
+def _spool_request_body():
+    """Streams the raw request body into a spooled temp file without buffering it all in memory first."""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+    while True:
+        chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 
 @app.route('/api/analyze-document', methods=['POST'])
 def analyze_document():
+    """
+    Accepts either a JSON body { file_data: <base64 data URL>, filename, prompt?, model? }
+    or multipart/form-data with a `file` part (plus optional `filename`, `prompt` and `model` fields).
+    `model` names a configuration from analyzer.MODEL_CONFIGS (e.g. flash or pro).
+    """
     try:
+        if request.mimetype == 'multipart/form-data':
+            # Werkzeug streams file parts into spooled temp files while parsing the form
+            upload = request.files.get('file')
+            filename = request.form.get('filename') or (upload.filename if upload else None)
+            if not upload or not filename:
+                return jsonify({"error": "Missing required fields: file and filename"}), 400
+
+            result = generate_caption_from_bytes(upload.stream, filename, request.form.get('prompt'),
+                                                 model=request.form.get('model'))
+            return _analysis_response(result)
+
         data = request.get_json()
         
         if not data or 'file_data' not in data or 'filename' not in data:
@@ -31,25 +110,155 @@ def analyze_document():
         filename = data['filename']
         custom_prompt = data.get('prompt')
         
-        result = generate_universal_caption(file_data, filename, custom_prompt)
-        
-        if 'error' in result:
-            return jsonify(result), 400
-        
-        return jsonify({
-            "success": True,
-            "summary": result['summary'],
-            "department": result['department'],
-            "priority": result.get('priority', 'Medium'),
-            "action_required": result.get('action_required', 'Review required')
-        })
+        result = generate_universal_caption(file_data, filename, custom_prompt, model=data.get('model'))
+        return _analysis_response(result)
         
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+
+@app.route('/api/analyze-document/stream', methods=['POST'])
+def analyze_document_stream():
+    """
+    Same inputs as /api/analyze-document, answered as Server-Sent Events: `summary` events carry
+    { text } chunks of the summary as Gemini generates it, then one `result` event carries the
+    /api/analyze-document response body, or an `error` event carries { error, retryable? }.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        filename = request.form.get('filename') or (upload.filename if upload else None)
+        if not upload or not filename:
+            return jsonify({"error": "Missing required fields: file and filename"}), 400
+        events = stream_caption_from_bytes(upload.stream, filename, request.form.get('prompt'),
+                                           model=request.form.get('model'))
+    else:
+        data = request.get_json(silent=True)
+        if not data or 'file_data' not in data or 'filename' not in data:
+            return jsonify({"error": "Missing required fields: file_data and filename"}), 400
+        events = stream_universal_caption(data['file_data'], data['filename'], data.get('prompt'), model=data.get('model'))
+
+    def generate():
+        for event, payload in events:
+            if event == 'summary':
+                yield _sse('summary', {"text": payload})
+            elif 'error' in payload:
+                yield _sse('error', payload)
+            else:
+                yield _sse('result', _analysis_payload(payload))
+
+    # stream_with_context keeps the request (and its uploaded file) open until the last event is sent
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/analyze-document/raw', methods=['POST'])
+def analyze_document_raw():
+    """
+    Accepts the file content as the raw request body.
+    The filename comes from the `filename` query parameter or X-Filename header; `prompt` and `model` are optional query parameters.
+    """
+    try:
+        filename = request.args.get('filename') or request.headers.get('X-Filename')
+        if not filename:
+            return jsonify({"error": "Missing required field: filename"}), 400
+
+        with _spool_request_body() as spool:
+            result = generate_caption_from_bytes(spool, filename, request.args.get('prompt'), model=request.args.get('model'))
+        return _analysis_response(result)
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@app.route('/api/analyze-documents', methods=['POST'])
+def analyze_documents_batch():
+    """
+    Analyzes many documents concurrently in one request.
+    Accepts a JSON body { documents: [{ file_data, filename, prompt?, model? }], prompt?, model?, concurrency? }
+    or multipart/form-data with repeated `files` parts (plus optional `prompt`, `model` and `concurrency` fields).
+    Returns { results: [...], succeeded, failed } with one entry per document in input order; each entry
+    has the /api/analyze-document response fields or { success: false, error }.
+    Analyses run as coroutines on the shared async engine, so this request holds no extra threads per document.
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            params = request.form
+            shared_prompt = params.get('prompt')
+            shared_model = params.get('model')
+            jobs = [
+                (lambda f=f: generate_caption_from_bytes_async(f.stream, f.filename, shared_prompt, model=shared_model), f.filename)
+                for f in request.files.getlist('files')
+            ]
+        else:
+            params = request.get_json() or {}
+            shared_prompt = params.get('prompt')
+            shared_model = params.get('model')
+            documents = params.get('documents')
+            if not isinstance(documents, list):
+                return jsonify({"error": "Missing required field: documents"}), 400
+            jobs = []
+            for doc in documents:
+                if not isinstance(doc, dict) or 'file_data' not in doc or 'filename' not in doc:
+                    jobs.append((None, doc.get('filename') if isinstance(doc, dict) else None))
+                    continue
+                jobs.append((lambda d=doc: generate_universal_caption_async(d['file_data'], d['filename'], d.get('prompt', shared_prompt),
+                                                                           model=d.get('model', shared_model)), doc['filename']))
+
+        if not jobs:
+            return jsonify({"error": "No documents provided"}), 400
+        if len(jobs) > ANALYZE_BATCH_MAX_DOCUMENTS:
+            return jsonify({"error": f"Too many documents: at most {ANALYZE_BATCH_MAX_DOCUMENTS} per request"}), 400
+
+        try:
+            concurrency = int(params.get('concurrency') or ANALYZE_BATCH_CONCURRENCY)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid concurrency: must be an integer"}), 400
+        concurrency = max(1, min(concurrency, ANALYZE_BATCH_MAX_CONCURRENCY, len(jobs)))
+
+        async def run(job):
+            analyze, filename = job
+            if analyze is None:
+                return {"filename": filename, "success": False, "error": "Missing required fields: file_data and filename"}
+            try:
+                result = await analyze()
+            except Exception as e:
+                result = {"error": f"Server error: {str(e)}"}
+            if 'error' in result:
+                return {"filename": filename, "success": False, "error": result['error']}
+            return {"filename": filename, **_analysis_payload(result)}
+
+        results = async_engine.map(run, jobs, concurrency)
+
+        succeeded = sum(1 for r in results if r['success'])
+        return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded})
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy", "message": "Backend API is running"})
+    return jsonify({
+        "status": "healthy",
+        "message": "Backend API is running",
+        "supabase_pool": pool_stats(),
+        "gemini_rate_limiter": get_gemini_limiter().stats(),
+        "image_preprocessing": preprocess_stats(),
+        "gmail_clients": client_stats(),
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-stage latency histograms, outcome and byte counters, and the health stats, in Prometheus text format."""
+    gauges = (
+        render_gauges("kmrl_supabase_pool", pool_stats(), "Supabase connection pool statistic.")
+        + render_gauges("kmrl_gemini_rate_limiter", get_gemini_limiter().stats(), "Gemini rate limiter statistic.")
+        + render_gauges("kmrl_image_preprocessing", preprocess_stats(), "Image preprocessing statistic.")
+        + render_gauges("kmrl_gmail_clients", client_stats(), "Gmail client cache statistic.")
+    )
+    return Response(render_metrics(gauges), mimetype="text/plain; version=0.0.4")
+
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, List, Optional
+
+# Upper bound on model calls the shared event loop keeps in flight at once, across all requests
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get("ASYNC_MAX_IN_FLIGHT", 64))
+
+
+class AsyncEngine:
+    """
+    A process-wide asyncio event loop running on a daemon thread.
+    WSGI worker threads hand coroutines to it with submit()/run(), so a single process can keep many
+    Gemini requests in flight without one OS thread per request. The SDK's async (grpc.aio) client is
+    bound to the loop that first uses it, which is why every caller shares this one loop.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max(1, max_in_flight)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+
+                    def run():
+                        asyncio.set_event_loop(loop)
+                        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+                        ready.set()
+                        loop.run_forever()
+
+                    threading.Thread(target=run, name="async-engine", daemon=True).start()
+                    ready.wait()
+                    self._loop = loop
+        return self._loop
+
+    async def _limited(self, coro: Awaitable[Any]) -> Any:
+        async with self._in_flight:
+            return await coro
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) -> Future:
+        """Schedules coro on the engine loop (subject to the in-flight cap) and returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(self._limited(coro), self._ensure_loop())
+
+    def run(self, coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+        """Runs coro on the engine loop and blocks the calling thread until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    def map(self, fn: Callable[[Any], Awaitable[Any]], items: Iterable[Any], concurrency: int) -> List[Any]:
+        """Runs fn(item) for every item with at most `concurrency` running at once; results keep input order."""
+        async def gather():
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def one(item):
+                async with semaphore:
+                    return await self._limited(fn(item))
+
+            return await asyncio.gather(*(one(item) for item in items))
+
+        return asyncio.run_coroutine_threadsafe(gather(), self._ensure_loop()).result()
+
+
+async_engine = AsyncEngine(ASYNC_MAX_IN_FLIGHT)
@@ -0,0 +1,8 @@
+"""
+Offline benchmarks for the analysis and Gmail import paths.
+
+Gemini, the Gmail API and Supabase are replaced by in-process fakes with configurable latency,
+error and 429 rates, so runs need no accounts or network access. Run from the backend directory:
+
+    python -m bench --scenario all --documents 200 --json run.json
+"""
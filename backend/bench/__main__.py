@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# Benchmarks measure the pipeline itself: never answer from the on-disk result cache
+os.environ["ANALYSIS_CACHE_ENABLED"] = "false"
+os.environ.setdefault("GEN_AI_API_KEY", "bench")
+
+import analyzer  # noqa: E402
+import rate_limiter  # noqa: E402
+from async_engine import async_engine  # noqa: E402
+from bench.corpus import DEFAULT_MIX, generate_corpus  # noqa: E402
+from bench.fakes import FakeGemini, FakeGmailService, FakeSupabase  # noqa: E402
+from bench.stats import RssSampler, StageRecorder, print_report  # noqa: E402
+
+SCENARIOS = ("analyze", "batch", "gmail")
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench", description="Offline throughput/latency benchmarks with fake Gemini, Gmail and Supabase.")
+    p.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all",
+                   help="analyze: threaded generate_caption_from_bytes; batch: async engine; gmail: full import pipeline")
+    p.add_argument("--documents", type=int, default=100, help="corpus size")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--mix", type=_parse_mix, default=None,
+                   help="corpus composition, e.g. pdf=0.5,image=0.2,text=0.2,scanned_pdf=0.1 (scanned PDFs need poppler)")
+    p.add_argument("--max-pdf-pages", type=int, default=40)
+    p.add_argument("--image-size", type=int, default=3000, help="long side of generated photos, in pixels")
+    p.add_argument("--concurrency", type=int, default=8, help="documents analyzed at once in the analyze and batch scenarios")
+
+    g = p.add_argument_group("fake Gemini")
+    g.add_argument("--gemini-latency", type=float, default=0.8, help="seconds per call before input-size cost")
+    g.add_argument("--gemini-per-1k-tokens", type=float, default=0.02, help="extra seconds per 1000 input tokens")
+    g.add_argument("--gemini-error-rate", type=float, default=0.0)
+    g.add_argument("--gemini-429-rate", type=float, default=0.0)
+    g.add_argument("--gemini-rpm", type=float, default=100000, help="rate limiter budget (default: effectively unlimited)")
+    g.add_argument("--gemini-tpm", type=float, default=1e9)
+    g.add_argument("--retry-base-delay", type=float, default=0.05)
+
+    g = p.add_argument_group("fake Gmail and Supabase")
+    g.add_argument("--gmail-latency", type=float, default=0.05)
+    g.add_argument("--gmail-error-rate", type=float, default=0.0)
+    g.add_argument("--gmail-429-rate", type=float, default=0.0)
+    g.add_argument("--attachments-per-message", type=int, default=2)
+    g.add_argument("--supabase-latency", type=float, default=0.03)
+    g.add_argument("--supabase-error-rate", type=float, default=0.0)
+    g.add_argument("--supabase-429-rate", type=float, default=0.0)
+    g.add_argument("--duplicate-rate", type=float, default=0.1, help="share of attachments already stored in Supabase")
+
+    p.add_argument("--json", help="write the results to this file")
+    p.add_argument("--compare", help="an earlier --json file to compare against")
+    p.add_argument("--verbose", action="store_true", help="show the application's debug output and logs")
+    return p.parse_args(argv)
+
+
+def _parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown document kinds: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def _is_failed(result: dict) -> bool:
+    return 'error' in result
+
+
+@contextlib.contextmanager
+def _fake_gemini(args, recorder: StageRecorder):
+    """Routes every analyzer model call to FakeGemini behind a freshly configured shared rate limiter."""
+    model = FakeGemini(recorder, latency=args.gemini_latency, per_1k_tokens=args.gemini_per_1k_tokens,
+                       error_rate=args.gemini_error_rate, rate_limit_rate=args.gemini_429_rate, seed=args.seed)
+    limiter = rate_limiter.AdaptiveRateLimiter(rpm=args.gemini_rpm, tpm=args.gemini_tpm,
+                                               base_delay=args.retry_base_delay, max_delay=args.retry_base_delay * 20)
+    with mock.patch.object(analyzer, "get_model", lambda config_name=None, system_instruction=None: model), \
+            mock.patch.object(rate_limiter, "_gemini_limiter", limiter):
+        yield
+
+
+@contextlib.contextmanager
+def _timed_stages(recorder: StageRecorder, module, stages: dict):
+    """Temporarily wraps module-level functions (looked up by name at call time) so each call is recorded."""
+    with contextlib.ExitStack() as stack:
+        for attr, stage in stages.items():
+            stack.enter_context(mock.patch.object(module, attr, recorder.timed(stage, getattr(module, attr))))
+        yield
+
+
+_ANALYZER_STAGES = {"_prepare_request": "prepare_request", "_build_model_input": "build_model_input"}
+
+
+def run_analyze(args, corpus) -> dict:
+    recorder = StageRecorder()
+    document = recorder.timed("document", analyzer.generate_caption_from_bytes, _is_failed)
+    with _fake_gemini(args, recorder), _timed_stages(recorder, analyzer, _ANALYZER_STAGES):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda d: document(d.data, d.filename, mime_type=d.mime_type), corpus))
+    return _summary(recorder, results)
+
+
+def run_batch(args, corpus) -> dict:
+    recorder = StageRecorder()
+
+    async def one(doc):
+        started = time.perf_counter()
+        result = await analyzer.generate_caption_from_bytes_async(doc.data, doc.filename, mime_type=doc.mime_type)
+        recorder.record("document", started, ok=not _is_failed(result))
+        return result
+
+    with _fake_gemini(args, recorder), _timed_stages(recorder, analyzer, _ANALYZER_STAGES):
+        results = async_engine.map(one, corpus, args.concurrency)
+    return _summary(recorder, results)
+
+
+def run_gmail(args, corpus) -> dict:
+    import gmail_clients
+    import gmail_service
+    from import_jobs import ImportJob
+
+    recorder = StageRecorder()
+    user_id = "bench-user"
+    duplicates = corpus[:int(len(corpus) * args.duplicate_rate)]
+    gmail = FakeGmailService(corpus, recorder, latency=args.gmail_latency, error_rate=args.gmail_error_rate,
+                             rate_limit_rate=args.gmail_429_rate, seed=args.seed,
+                             attachments_per_message=args.attachments_per_message)
+    supabase = FakeSupabase(recorder, latency=args.supabase_latency, error_rate=args.supabase_error_rate,
+                            rate_limit_rate=args.supabase_429_rate, seed=args.seed,
+                            existing_paths=[f"{user_id}/{d.filename}" for d in duplicates])
+    stages = {"_fetch_message_attachments": "fetch", "_analyze_attachment": "analyze", "_persist_attachment": "persist"}
+
+    with _fake_gemini(args, recorder), _timed_stages(recorder, analyzer, _ANALYZER_STAGES), \
+            _timed_stages(recorder, gmail_service, stages), \
+            mock.patch.object(gmail_service, "gmail_clients", gmail_clients.GmailClientCache()), \
+            mock.patch.object(gmail_clients, "_build_service", lambda creds: gmail), \
+            mock.patch.object(gmail_service, "supabase_request", supabase.request), \
+            mock.patch.object(gmail_service, "SUPABASE_URL", "http://supabase.bench"), \
+            mock.patch.object(gmail_service, "SUPABASE_SERVICE_ROLE_KEY", "bench"):
+        job = ImportJob(user_id)
+        entry = {"user_id": user_id, "credentials": {"token": "bench"}}
+        details = gmail_service._run_import(job, entry, "has:attachment", len(gmail.mailbox), False)
+
+    results = [{"error": d.get("error") or d["status"]} if d.get("error") or d.get("status") not in ("imported", "skipped_duplicate") else d
+               for d in details]
+    return _summary(recorder, results)
+
+
+def _summary(recorder: StageRecorder, results: list) -> dict:
+    return {"stages": recorder.report(), "failed": sum(1 for r in results if _is_failed(r)), "documents": len(results)}
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    print(f"Generating {args.documents} documents (seed {args.seed})...")
+    corpus = generate_corpus(args.documents, seed=args.seed, mix=args.mix, max_pdf_pages=args.max_pdf_pages, image_size=args.image_size)
+    print(f"Corpus: {sum(len(d.data) for d in corpus) / 2 ** 20:.1f} MB")
+
+    runners = {"analyze": run_analyze, "batch": run_batch, "gmail": run_gmail}
+    results = {"config": vars(args), "scenarios": {}}
+    for name in scenarios:
+        print(f"Running {name}...")
+        with open(os.devnull, "w") as devnull, contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            with RssSampler() as rss:
+                started = time.perf_counter()
+                summary = runners[name](args, corpus)
+                wall = time.perf_counter() - started
+        summary.update(
+            wall_seconds=round(wall, 2),
+            docs_per_sec=round(summary["documents"] / wall, 2),
+            peak_rss_mb=round(rss.peak / 2 ** 20, 1),
+        )
+        results["scenarios"][name] = summary
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(results, previous)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
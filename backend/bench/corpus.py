@@ -0,0 +1,128 @@
+import random
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageDraw
+
+from keyword_classifier import DEPARTMENT_KEYWORDS, HIGH_PRIORITY_KEYWORDS
+
+# Share of each document kind in a generated corpus
+DEFAULT_MIX = {"pdf": 0.5, "image": 0.2, "text": 0.2, "scanned_pdf": 0.1}
+
+_FILLER = (
+    "the metro rail corridor report covers daily operations across all stations and depots and lists "
+    "the measures taken by each section during the period under review together with pending items "
+    "that require follow up from the concerned officers before the next review meeting"
+).split()
+_LINES_PER_PAGE = 48
+_WORDS_PER_LINE = 12
+
+
+@dataclass
+class Document:
+    filename: str
+    mime_type: str
+    data: bytes
+
+
+def generate_corpus(count: int, seed: int = 1, mix: Optional[Dict[str, float]] = None,
+                    max_pdf_pages: int = 40, image_size: int = 3000) -> List[Document]:
+    """
+    Builds count synthetic documents: text PDFs of 1..max_pdf_pages pages, image-only (scanned) PDFs,
+    JPEG photos of notices around image_size pixels on the long side, and plain text files.
+    Text mixes filler with department and high-priority keywords, so every classification path is exercised.
+    The same seed always produces the same corpus.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    documents = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "pdf":
+            pages = [_page_lines(rng) for _ in range(rng.randint(1, max_pdf_pages))]
+            documents.append(Document(f"report-{i:05d}.pdf", "application/pdf", make_text_pdf(pages)))
+        elif kind == "scanned_pdf":
+            pages = [_page_lines(rng) for _ in range(rng.randint(1, 4))]
+            documents.append(Document(f"scan-{i:05d}.pdf", "application/pdf", make_scanned_pdf(pages)))
+        elif kind == "image":
+            documents.append(Document(f"notice-{i:05d}.jpg", "image/jpeg", make_photo(rng, _page_lines(rng)[:12], image_size)))
+        else:
+            text = "\n".join(line for _ in range(rng.randint(1, 6)) for line in _page_lines(rng))
+            documents.append(Document(f"memo-{i:05d}.txt", "text/plain", text.encode("utf-8")))
+    return documents
+
+
+def _page_lines(rng: random.Random) -> List[str]:
+    keywords = [k for words in DEPARTMENT_KEYWORDS.values() for k in words]
+    urgent = [k for words in HIGH_PRIORITY_KEYWORDS.values() for k in words]
+    lines = []
+    for _ in range(_LINES_PER_PAGE):
+        words = rng.choices(_FILLER, k=_WORDS_PER_LINE)
+        words[rng.randrange(len(words))] = rng.choice(keywords)
+        if rng.random() < 0.01:
+            words[rng.randrange(len(words))] = rng.choice(urgent)
+        lines.append(" ".join(words))
+    return lines
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_text_pdf(pages: List[List[str]]) -> bytes:
+    """Writes a minimal PDF with one Helvetica text page per entry of pages (a list of lines each)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        body = "BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % content_id)
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, obj))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def _render_page(lines: List[str], size=(1240, 1754)) -> Image.Image:
+    page = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(page)
+    for i, line in enumerate(lines):
+        draw.text((60, 60 + i * 34), line, fill=0)
+    return page
+
+
+def make_scanned_pdf(pages: List[List[str]]) -> bytes:
+    """An image-only PDF (no text layer) with one rendered A4 page at 150 dpi per entry of pages."""
+    images = [_render_page(lines) for lines in pages]
+    out = BytesIO()
+    images[0].save(out, "PDF", resolution=150, save_all=True, append_images=images[1:])
+    return out.getvalue()
+
+
+def make_photo(rng: random.Random, lines: List[str], long_side: int) -> bytes:
+    """A phone-photo-like JPEG: a printed notice on a noisy, coloured background."""
+    width, height = long_side * 3 // 4, long_side
+    background = Image.merge("RGB", [Image.effect_noise((width, height), 40).point(lambda v, o=o: min(255, v + o))
+                                     for o in (rng.randint(20, 90), rng.randint(20, 90), rng.randint(20, 90))])
+    notice = _render_page(lines, (width * 3 // 4, height * 3 // 4)).convert("RGB")
+    background.paste(notice, (width // 8, height // 8))
+    out = BytesIO()
+    background.save(out, "JPEG", quality=92)
+    return out.getvalue()
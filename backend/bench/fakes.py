@@ -0,0 +1,327 @@
+import re
+import json
+import time
+import base64
+import random
+import asyncio
+import threading
+from typing import List, Optional
+from urllib.parse import urlparse
+
+import httplib2
+from google.api_core import exceptions as google_exceptions
+from googleapiclient.errors import HttpError
+
+from analysis_schema import DEPARTMENTS, PRIORITIES, SUMMARY_WIRE_FIELD
+from bench.corpus import Document
+from bench.stats import StageRecorder
+
+_IMAGE_TOKENS = 258
+_CHARS_PER_TOKEN = 4
+
+
+class _Faults:
+    """Latency and failure injection shared by the fakes; thread-safe and reproducible for a given seed."""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, rate_limit_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, extra: float = 0.0) -> float:
+        with self._lock:
+            return max(0.0, self.latency + extra + self._rng.uniform(-self.jitter, self.jitter) * self.latency)
+
+    def outcome(self) -> Optional[str]:
+        """None for success, otherwise "rate_limited" or "error"."""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return "rate_limited"
+        if roll < self.rate_limit_rate + self.error_rate:
+            return "error"
+        return None
+
+    def choice(self, seq):
+        with self._lock:
+            return self._rng.choice(seq)
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeStream:
+    """Mimics a stream=True response: iterating yields chunks, and .text is the full answer afterwards."""
+
+    def __init__(self, text: str, chunks: int, chunk_delay: float):
+        self.text = text
+        size = max(1, len(text) // max(1, chunks))
+        self._pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self._chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for i, piece in enumerate(self._pieces):
+            if i:
+                time.sleep(self._chunk_delay)
+            yield _FakeResponse(piece)
+
+
+class FakeGemini:
+    """
+    Stands in for genai.GenerativeModel. Latency grows with the estimated input tokens, 429s and 503s are
+    raised as the same google.api_core exceptions the SDK raises, and answers follow the requested
+    response schema (or are plain text when no schema is given, as for long-document chunk summaries).
+    """
+
+    def __init__(self, recorder: StageRecorder, latency: float = 0.8, jitter: float = 0.3, per_1k_tokens: float = 0.02,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0, stream_chunks: int = 8):
+        self.recorder = recorder
+        self.per_1k_tokens = per_1k_tokens
+        self.stream_chunks = stream_chunks
+        self._faults = _Faults(latency, jitter, error_rate, rate_limit_rate, seed)
+
+    def _prepare(self, contents, generation_config):
+        tokens = sum(len(p) // _CHARS_PER_TOKEN if isinstance(p, str) else _IMAGE_TOKENS for p in contents)
+        delay = self._faults.delay(tokens / 1000 * self.per_1k_tokens)
+        outcome = self._faults.outcome()
+        if outcome == "rate_limited":
+            error = google_exceptions.ResourceExhausted("429 Resource has been exhausted (bench)")
+        elif outcome == "error":
+            error = google_exceptions.ServiceUnavailable("503 The service is currently unavailable (bench)")
+        else:
+            error = None
+        return delay, error, self._answer(tokens, generation_config)
+
+    def _answer(self, tokens: int, generation_config) -> str:
+        summary = f"Synthetic summary of a document of about {tokens} input tokens."
+        schema = (generation_config or {}).get("response_schema")
+        if not schema:
+            return summary
+        answer = {SUMMARY_WIRE_FIELD: summary, "action_required": "Review required"}
+        if "department" in schema.get("properties", {}):
+            answer["department"] = self._faults.choice(DEPARTMENTS)
+            answer["priority"] = self._faults.choice(PRIORITIES)
+        return json.dumps(answer)
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        started = time.perf_counter()
+        delay, error, text = self._prepare(contents, generation_config)
+        if stream:
+            # Time to first chunk; the rest of the answer trickles in while the caller iterates
+            delay /= 2
+        time.sleep(delay)
+        self.recorder.record("gemini_call", started, ok=error is None)
+        if error is not None:
+            raise error
+        if stream:
+            return _FakeStream(text, self.stream_chunks, delay / self.stream_chunks)
+        return _FakeResponse(text)
+
+    async def generate_content_async(self, contents, generation_config=None):
+        started = time.perf_counter()
+        delay, error, text = self._prepare(contents, generation_config)
+        await asyncio.sleep(delay)
+        self.recorder.record("gemini_call", started, ok=error is None)
+        if error is not None:
+            raise error
+        return _FakeResponse(text)
+
+
+def _http_error(status: int, reason: str) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), json.dumps({"error": {"message": reason}}).encode())
+
+
+class _Call:
+    """A prepared API call; execute() pays the per-request latency, batches pay it once for all parts."""
+
+    def __init__(self, service: "FakeGmailService", stage: str, fn):
+        self.service = service
+        self.stage = stage
+        self.fn = fn
+
+    def execute(self):
+        started = time.perf_counter()
+        time.sleep(self.service.faults.delay())
+        try:
+            result = self.run()
+        except Exception:
+            self.service.recorder.record(self.stage, started, ok=False)
+            raise
+        self.service.recorder.record(self.stage, started)
+        return result
+
+    def run(self):
+        outcome = self.service.faults.outcome()
+        if outcome == "rate_limited":
+            raise _http_error(429, "User-rate limit exceeded (bench)")
+        if outcome == "error":
+            raise _http_error(503, "Backend error (bench)")
+        return self.fn()
+
+
+class _FakeBatch:
+    def __init__(self, service: "FakeGmailService", callback):
+        self.service = service
+        self.callback = callback
+        self._calls = []
+
+    def add(self, request: _Call, request_id: str = None):
+        self._calls.append((request_id, request))
+
+    def execute(self):
+        started = time.perf_counter()
+        time.sleep(self.service.faults.delay())
+        for request_id, request in self._calls:
+            try:
+                response, error = request.run(), None
+            except Exception as e:
+                response, error = None, e
+            self.callback(request_id, response, error)
+        self.service.recorder.record("gmail_batch_get", started)
+
+
+class FakeGmailService:
+    """
+    Stands in for build('gmail', 'v1') over a synthetic mailbox: each message carries a few corpus documents
+    as attachments. Implements the calls the importer makes (messages.list/get, attachments.get, getProfile,
+    history.list and batch requests). Safe to share between threads, unlike the real client.
+    """
+
+    def __init__(self, documents: List[Document], recorder: StageRecorder, latency: float = 0.05, jitter: float = 0.3,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0, attachments_per_message: int = 2):
+        self.recorder = recorder
+        self.faults = _Faults(latency, jitter, error_rate, rate_limit_rate, seed)
+        self.mailbox = []
+        self.attachment_data = {}
+        rng = random.Random(seed)
+        i = 0
+        while i < len(documents):
+            count = rng.randint(1, max(1, attachments_per_message * 2 - 1))
+            message_id = f"m{len(self.mailbox):06d}"
+            parts = [{"partId": "0", "filename": "", "mimeType": "text/plain", "body": {"size": 120}}]
+            for doc in documents[i:i + count]:
+                attachment_id = f"a{len(self.attachment_data):06d}"
+                self.attachment_data[attachment_id] = base64.urlsafe_b64encode(doc.data).decode()
+                parts.append({"partId": str(len(parts)), "filename": doc.filename, "mimeType": doc.mime_type,
+                              "body": {"attachmentId": attachment_id, "size": len(doc.data)}})
+            self.mailbox.append({
+                "id": message_id,
+                "payload": {"headers": [{"name": "Subject", "value": f"Circular {message_id}"}], "parts": parts},
+            })
+            i += count
+        self._by_id = {m["id"]: m for m in self.mailbox}
+
+    # Resource accessors, mirroring the discovery client's method chain
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return _FakeHistory(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+    def getProfile(self, userId, fields=None):
+        return _Call(self, "gmail_profile", lambda: {"historyId": "1000"})
+
+    def list(self, userId, q=None, maxResults=100, pageToken=None, fields=None):
+        def page():
+            start = int(pageToken or 0)
+            end = min(start + maxResults, len(self.mailbox))
+            resp = {"messages": [{"id": m["id"]} for m in self.mailbox[start:end]]}
+            if end < len(self.mailbox):
+                resp["nextPageToken"] = str(end)
+            return resp
+
+        return _Call(self, "gmail_list", page)
+
+    def get(self, userId, id, format=None, fields=None, messageId=None):
+        if messageId is not None:
+            # attachments().get(userId, messageId, id)
+            return _Call(self, "gmail_attachment", lambda: {"data": self.attachment_data[id], "size": len(self.attachment_data[id])})
+        return _Call(self, "gmail_get", lambda: self._by_id[id])
+
+    def attachments(self):
+        return self
+
+
+class _FakeHistory:
+    def __init__(self, service: FakeGmailService):
+        self.service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, maxResults=100, pageToken=None, fields=None):
+        return _Call(self.service, "gmail_history", lambda: {"history": [], "historyId": "1000"})
+
+
+class _FakeHttpResponse:
+    def __init__(self, status_code: int, payload=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = json.dumps(payload) if payload is not None else ""
+        self.ok = 200 <= status_code < 400
+
+    def json(self):
+        return self._payload
+
+
+_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+class FakeSupabase:
+    """
+    Stands in for supabase_request() against Storage uploads and the documents table (eq./in. filters
+    and bulk inserts). Failures come back as 503/429 responses directly: the real shared session would
+    retry those inside its adapter, so injected rates here are what remains after retries.
+    """
+
+    def __init__(self, recorder: StageRecorder, latency: float = 0.03, jitter: float = 0.3, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, seed: int = 0, existing_paths=()):
+        self.recorder = recorder
+        self.faults = _Faults(latency, jitter, error_rate, rate_limit_rate, seed)
+        self._lock = threading.Lock()
+        self.objects = {}
+        self.rows = []
+        self.paths = set(existing_paths)
+
+    def request(self, method: str, url: str, headers=None, params=None, data=None, **kwargs):
+        path = urlparse(url).path
+        if "/storage/v1/object/" in path:
+            stage = "supabase_upload"
+        elif method == "GET":
+            stage = "supabase_dup_check"
+        else:
+            stage = "supabase_insert"
+
+        started = time.perf_counter()
+        time.sleep(self.faults.delay())
+        outcome = self.faults.outcome()
+        if outcome is not None:
+            self.recorder.record(stage, started, ok=False)
+            return _FakeHttpResponse(429 if outcome == "rate_limited" else 503, {"message": "bench fault"})
+
+        with self._lock:
+            if stage == "supabase_upload":
+                self.objects[path.split("/storage/v1/object/", 1)[1]] = len(data or b"")
+                resp = _FakeHttpResponse(200, {"Key": path})
+            elif stage == "supabase_dup_check":
+                wanted = (params or {}).get("path", "")
+                if wanted.startswith("in.("):
+                    candidates = {m.replace('\\"', '"').replace("\\\\", "\\") for m in _QUOTED.findall(wanted)}
+                else:
+                    candidates = {wanted[len("eq."):]}
+                resp = _FakeHttpResponse(200, [{"path": p, "id": p} for p in candidates & self.paths])
+            else:
+                rows = json.loads(data)
+                self.rows.extend(rows)
+                self.paths.update(row["path"] for row in rows)
+                resp = _FakeHttpResponse(201)
+        self.recorder.record(stage, started)
+        return resp
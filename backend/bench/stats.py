@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import threading
+import functools
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where the current value is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class StageRecorder:
+    """
+    Collects per-stage call latencies, failures, wall-clock span and the highest RSS seen when a call
+    of that stage finished. Stages overlap in the concurrent pipelines, so RSS is attributed per stage
+    on a best-effort basis; RssSampler gives the exact peak for a whole scenario.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, dict] = {}
+
+    def record(self, stage: str, started: float, ok: bool = True) -> None:
+        ended = time.perf_counter()
+        rss = current_rss()
+        with self._lock:
+            s = self._stages.setdefault(stage, {"latencies": [], "errors": 0, "first": started, "last": ended, "peak_rss": 0})
+            s["latencies"].append(ended - started)
+            if not ok:
+                s["errors"] += 1
+            s["first"] = min(s["first"], started)
+            s["last"] = max(s["last"], ended)
+            s["peak_rss"] = max(s["peak_rss"], rss)
+
+    def timed(self, stage: str, fn: Callable, is_error: Optional[Callable] = None) -> Callable:
+        """Wraps fn so every call is recorded under stage; is_error(result) marks returned failures."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                self.record(stage, started, ok=False)
+                raise
+            self.record(stage, started, ok=not (is_error and is_error(result)))
+            return result
+
+        return wrapper
+
+    def report(self) -> Dict[str, dict]:
+        with self._lock:
+            stages = {name: dict(s, latencies=list(s["latencies"])) for name, s in self._stages.items()}
+        out = {}
+        for name, s in stages.items():
+            latencies = s["latencies"]
+            span = max(s["last"] - s["first"], 1e-9)
+            out[name] = {
+                "calls": len(latencies),
+                "errors": s["errors"],
+                "per_sec": round(len(latencies) / span, 2),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                "peak_rss_mb": round(s["peak_rss"] / 2 ** 20, 1),
+            }
+        return out
+
+
+class RssSampler:
+    """Samples RSS on a background thread while active and keeps the peak."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, name="bench-rss", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+
+def print_report(results: dict, previous: Optional[dict] = None) -> None:
+    """Prints one table per scenario; with previous (an earlier --json run), adds the change in per_sec and p95."""
+    for name, scenario in results["scenarios"].items():
+        before = (previous or {}).get("scenarios", {}).get(name, {})
+        print(f"\n== {name}: {scenario['documents']} documents in {scenario['wall_seconds']}s, "
+              f"{scenario['docs_per_sec']} docs/sec{_change(before.get('docs_per_sec'), scenario['docs_per_sec'])}, "
+              f"{scenario['failed']} failed, peak RSS {scenario['peak_rss_mb']} MB")
+        print(f"{'stage':<22}{'calls':>7}{'errors':>7}{'per_sec':>10}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}{'rss_mb':>9}")
+        for stage, s in scenario["stages"].items():
+            prev = before.get("stages", {}).get(stage, {})
+            print(f"{stage:<22}{s['calls']:>7}{s['errors']:>7}{s['per_sec']:>10}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+                  f"{s['p99_ms']:>10}{s['peak_rss_mb']:>9}"
+                  f"{'':4}{_change(prev.get('per_sec'), s['per_sec'], 'per_sec')}{_change(prev.get('p95_ms'), s['p95_ms'], 'p95')}")
+
+
+def _change(old, new, label: str = "") -> str:
+    if not old:
+        return ""
+    prefix = f" {label}" if label else ""
+    return f"{prefix} ({(new - old) / old * 100:+.0f}%)"
@@ -0,0 +1,177 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+# Access tokens are refreshed this long before they expire, so no import starts with a token about to lapse
+GMAIL_TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("GMAIL_TOKEN_REFRESH_MARGIN_SECONDS", 300))
+# Idle service objects kept per user, and users kept before the least recently used one is dropped
+GMAIL_CLIENT_POOL_SIZE = int(os.environ.get("GMAIL_CLIENT_POOL_SIZE", 8))
+GMAIL_CLIENT_CACHE_USERS = int(os.environ.get("GMAIL_CLIENT_CACHE_USERS", 64))
+
+logger = logging.getLogger(__name__)
+
+
+def _build_service(creds: Credentials):
+    return build('gmail', 'v1', credentials=creds, cache_discovery=False)
+
+
+def credentials_to_dict(creds: Credentials) -> dict:
+    """The fields kept in the token store; expiry lets the cache refresh before the token lapses."""
+    return {
+        "token": creds.token,
+        "refresh_token": creds.refresh_token,
+        "token_uri": creds.token_uri,
+        "client_id": creds.client_id,
+        "client_secret": creds.client_secret,
+        "scopes": creds.scopes,
+        "expiry": creds.expiry.isoformat() if creds.expiry else None,
+    }
+
+
+def _credentials_from_dict(cred_dict: dict) -> Credentials:
+    expiry = cred_dict.get('expiry')
+    return Credentials(
+        token=cred_dict.get('token'),
+        refresh_token=cred_dict.get('refresh_token'),
+        token_uri=cred_dict.get('token_uri'),
+        client_id=cred_dict.get('client_id'),
+        client_secret=cred_dict.get('client_secret'),
+        scopes=cred_dict.get('scopes'),
+        # google-auth compares expiry against naive UTC datetimes
+        expiry=datetime.fromisoformat(expiry) if expiry else None,
+    )
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class _UserClients:
+    def __init__(self, cred_dict: dict):
+        self.cred_dict = cred_dict
+        self.creds = _credentials_from_dict(cred_dict)
+        self.idle = []
+        self.lock = threading.Lock()
+
+
+class GmailClientCache:
+    """
+    Per-user cache of Gmail API clients. Each user's Credentials object is shared by all of their
+    clients and refreshed under a per-user lock shortly before it expires, with the new token written
+    back to the token store entry. Built service objects wrap an httplib2 connection and are not
+    thread-safe, so each is lent to one caller at a time and returned to the user's idle pool afterwards.
+    """
+
+    def __init__(self, pool_size: int = GMAIL_CLIENT_POOL_SIZE, max_users: int = GMAIL_CLIENT_CACHE_USERS,
+                 refresh_margin: float = GMAIL_TOKEN_REFRESH_MARGIN_SECONDS):
+        self.pool_size = pool_size
+        self.max_users = max_users
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._users: "OrderedDict[str, _UserClients]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._reuses = 0
+        self._refreshes = 0
+
+    def _user(self, user_key: str, cred_dict: dict) -> _UserClients:
+        with self._lock:
+            user = self._users.get(user_key)
+            # A new OAuth grant for the same user replaces the cached credentials and their clients
+            if user is None or user.cred_dict.get('refresh_token') != cred_dict.get('refresh_token'):
+                user = self._users[user_key] = _UserClients(cred_dict)
+            self._users.move_to_end(user_key)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return user
+
+    def _ensure_fresh(self, user: _UserClients) -> None:
+        creds = user.creds
+        if creds.token and (creds.expiry is None or creds.expiry - self.refresh_margin > _utcnow()):
+            return
+        if not creds.refresh_token:
+            return
+        with user.lock:
+            # Another thread may have refreshed while this one waited for the lock
+            if creds.token and creds.expiry is not None and creds.expiry - self.refresh_margin > _utcnow():
+                return
+            creds.refresh(Request())
+            user.cred_dict.update(token=creds.token, expiry=creds.expiry.isoformat() if creds.expiry else None)
+        with self._lock:
+            self._refreshes += 1
+        logger.debug("Refreshed Gmail access token, valid until %s", creds.expiry)
+
+    def _checkout(self, user_key: str, cred_dict: dict):
+        user = self._user(user_key, cred_dict)
+        self._ensure_fresh(user)
+        with user.lock:
+            service = user.idle.pop() if user.idle else None
+        with self._lock:
+            if service is None:
+                self._builds += 1
+            else:
+                self._reuses += 1
+        if service is None:
+            service = _build_service(user.creds)
+        return user, service
+
+    def _checkin(self, user: _UserClients, service) -> None:
+        with user.lock:
+            if len(user.idle) < self.pool_size:
+                user.idle.append(service)
+
+    @contextmanager
+    def client(self, user_key: str, cred_dict: dict) -> Iterator:
+        """Lends a Gmail service for user_key to the caller for the duration of the block."""
+        user, service = self._checkout(user_key, cred_dict)
+        try:
+            yield service
+        finally:
+            self._checkin(user, service)
+
+    @contextmanager
+    def per_thread(self, user_key: str, cred_dict: dict) -> Iterator[Callable[[], object]]:
+        """
+        Yields a getter returning one service per calling thread, for worker pools that make Gmail
+        calls concurrently. All services go back to the pool when the block exits, so the workers
+        must be finished by then.
+        """
+        local = threading.local()
+        leased = []
+        leased_lock = threading.Lock()
+
+        def get_service():
+            service = getattr(local, "service", None)
+            if service is None:
+                user, service = self._checkout(user_key, cred_dict)
+                local.service = service
+                with leased_lock:
+                    leased.append((user, service))
+            return service
+
+        try:
+            yield get_service
+        finally:
+            for user, service in leased:
+                self._checkin(user, service)
+
+    def stats(self) -> dict:
+        with self._lock:
+            users = list(self._users.values())
+            stats = {"users": len(users), "builds": self._builds, "reuses": self._reuses, "refreshes": self._refreshes}
+        stats["idle_clients"] = sum(len(u.idle) for u in users)
+        return stats
+
+
+gmail_clients = GmailClientCache()
+
+
+def client_stats() -> dict:
+    return gmail_clients.stats()
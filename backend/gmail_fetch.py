@@ -0,0 +1,222 @@
+import os
+import time
+import logging
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Calls per Gmail batch request (Gmail accepts up to 100, but recommends staying around 50)
+GMAIL_BATCH_SIZE = int(os.environ.get("GMAIL_BATCH_SIZE", 50))
+GMAIL_BATCH_MAX_RETRIES = int(os.environ.get("GMAIL_BATCH_MAX_RETRIES", 2))
+# messages().list returns at most 500 ids per page
+GMAIL_LIST_PAGE_SIZE = min(int(os.environ.get("GMAIL_LIST_PAGE_SIZE", 500)), 500)
+
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _parts_mask(depth: int) -> str:
+    mask = "partId,filename,mimeType,body/attachmentId,body/size"
+    if depth > 0:
+        mask += f",parts({_parts_mask(depth - 1)})"
+    return mask
+
+
+# Only what the importer reads: the headers and the attachment part tree, without inline body data.
+# format=metadata would drop the part tree entirely, so we ask for format=full and mask it instead.
+MESSAGE_FIELDS = f"id,payload(headers,{_parts_mask(5)})"
+LIST_FIELDS = "messages/id,nextPageToken"
+HISTORY_FIELDS = "history(id,messagesAdded/message(id,labelIds)),historyId,nextPageToken"
+
+# Labels whose newly added messages never need importing
+_HISTORY_SKIP_LABELS = {"DRAFT", "SPAM", "TRASH"}
+
+
+def iter_message_ids(service, query: str, max_results: int, page_size: int = GMAIL_LIST_PAGE_SIZE) -> Iterator[str]:
+    """
+    Yields ids of messages matching query, following nextPageToken lazily until max_results ids
+    have been produced or the results run out. Each page is requested only when the consumer
+    needs it, and pages are never larger than the remaining budget.
+    """
+    remaining = max_results
+    page_token = None
+    while remaining > 0:
+        kwargs = {"userId": 'me', "q": query, "maxResults": min(remaining, page_size), "fields": LIST_FIELDS}
+        if page_token:
+            kwargs["pageToken"] = page_token
+        with stage_timer("gmail_list"):
+            resp = service.users().messages().list(**kwargs).execute()
+        page = resp.get('messages', [])[:remaining]
+        logger.debug("Query '%s' page returned %d messages", query, len(page))
+        for m in page:
+            yield m['id']
+        remaining -= len(page)
+        page_token = resp.get('nextPageToken')
+        if not page_token or not page:
+            return
+
+
+def iter_message_ids_with_fallback(service, query: str, max_results: int,
+                                   fallback_queries: List[str], fallback_max_results: int) -> Iterator[str]:
+    """
+    Streams ids for query; if it matches nothing (or fails), tries each fallback query in order and
+    streams the first one that matches anything. A fallback only costs a list call when every earlier
+    query came back empty, and the winning query's first page is reused rather than fetched twice.
+    An API error on a later page ends the stream with the ids produced so far.
+    """
+    for q, budget in [(query, max_results)] + [(fq, fallback_max_results) for fq in fallback_queries]:
+        ids = iter_message_ids(service, q, budget)
+        try:
+            first = next(ids)
+        except StopIteration:
+            logger.info("No messages found with query: '%s'", q)
+            continue
+        except Exception as e:
+            logger.warning("Error with query '%s': %s", q, e)
+            continue
+        if q != query:
+            logger.info("Using fallback query results: '%s'", q)
+        yield first
+        try:
+            yield from ids
+        except HttpError as e:
+            # Keep what was already streamed instead of failing the whole import on a later page
+            logger.warning("Stopping pagination for query '%s' after error: %s", q, e)
+        return
+
+
+def current_history_id(service) -> Optional[str]:
+    """Returns the mailbox's latest historyId, used as the checkpoint for the next incremental sync."""
+    return service.users().getProfile(userId='me', fields='historyId').execute().get('historyId')
+
+
+class HistoryMessageSource:
+    """
+    Iterates ids of messages added since start_history_id via users.history.list, lazily following
+    nextPageToken until max_results ids have been produced.
+
+    After iteration, checkpoint() is the historyId to resume from: the mailbox's latest historyId
+    when every page was consumed, otherwise the id of the last history record fully handed out.
+    """
+
+    def __init__(self, service, start_history_id: str, max_results: int, page_size: int = GMAIL_LIST_PAGE_SIZE):
+        self.service = service
+        self.start_history_id = start_history_id
+        self.max_results = max_results
+        self.page_size = page_size
+        self.exhausted = False
+        self.last_history_id = start_history_id
+        self.latest_history_id: Optional[str] = None
+        # Fetched eagerly so an expired checkpoint (404) surfaces before the import starts streaming
+        self._first_page = self._list_page(None)
+
+    def _list_page(self, page_token: Optional[str]) -> dict:
+        kwargs = {
+            "userId": 'me',
+            "startHistoryId": self.start_history_id,
+            "historyTypes": ['messageAdded'],
+            "maxResults": self.page_size,
+            "fields": HISTORY_FIELDS,
+        }
+        if page_token:
+            kwargs["pageToken"] = page_token
+        with stage_timer("gmail_history"):
+            return self.service.users().history().list(**kwargs).execute()
+
+    def __iter__(self) -> Iterator[str]:
+        remaining = self.max_results
+        seen = set()
+        resp = self._first_page
+        while True:
+            self.latest_history_id = resp.get('historyId', self.latest_history_id)
+            for record in resp.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg = added.get('message', {})
+                    if msg.get('id') in seen or _HISTORY_SKIP_LABELS.intersection(msg.get('labelIds', [])):
+                        continue
+                    if remaining <= 0:
+                        return
+                    seen.add(msg['id'])
+                    remaining -= 1
+                    yield msg['id']
+                self.last_history_id = record.get('id', self.last_history_id)
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                self.exhausted = True
+                return
+            resp = self._list_page(page_token)
+
+    def checkpoint(self) -> str:
+        if self.exhausted and self.latest_history_id:
+            return self.latest_history_id
+        return self.last_history_id
+
+
+def history_checkpoint_expired(error: Exception) -> bool:
+    """history.list answers 404 when startHistoryId is too old (roughly a week) to replay."""
+    return isinstance(error, HttpError) and getattr(error.resp, "status", None) == 404
+
+
+def batch_get_messages(service, message_ids: Iterable[str],
+                       batch_size: int = GMAIL_BATCH_SIZE) -> Iterator[Tuple[str, Optional[dict], Optional[Exception]]]:
+    """
+    Yields (message_id, message, error) for each id, fetching them through Gmail batch requests of
+    batch_size calls each. Chunks are requested lazily, so the first messages are available after a
+    single round trip. Works with any discovery-built service, including one built from a recorded
+    discovery document with googleapiclient.http.HttpMockSequence.
+    """
+    ids = iter(message_ids)
+    while True:
+        chunk = list(islice(ids, batch_size))
+        if not chunk:
+            return
+        results = _execute_get_batch(service, chunk)
+        for i, message_id in enumerate(chunk):
+            message, error = results[i]
+            yield message_id, message, error
+
+
+def _execute_get_batch(service, chunk: list) -> dict:
+    """
+    Runs one batch of messages.get calls, retrying rate-limited or 5xx parts with backoff. A failure of
+    the whole batch request is retried the same way and, if it persists, recorded for every message.
+    """
+    results = {}
+    todo = list(range(len(chunk)))
+
+    for attempt in range(GMAIL_BATCH_MAX_RETRIES + 1):
+        def callback(request_id, response, exception):
+            results[int(request_id)] = (response, exception)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for i in todo:
+            request = service.users().messages().get(userId='me', id=chunk[i], format='full', fields=MESSAGE_FIELDS)
+            batch.add(request, request_id=str(i))
+        try:
+            with stage_timer("gmail_get"):
+                batch.execute()
+        except Exception as e:
+            # The batch request itself failed (transport error or non-2xx from the batch endpoint):
+            # every pending part gets that error and the whole batch is retried
+            logger.warning("Gmail batch request for %d messages failed: %s", len(todo), e)
+            for i in todo:
+                results[i] = (None, e)
+        else:
+            todo = [i for i in todo if _is_retryable(results.get(i, (None, None))[1])]
+        if not todo or attempt == GMAIL_BATCH_MAX_RETRIES:
+            break
+        logger.info("Retrying %d messages.get calls from batch", len(todo))
+        time.sleep(0.5 * (2 ** attempt))
+
+    for i in range(len(chunk)):
+        if i not in results:
+            results[i] = (None, RuntimeError(f"No response for message {chunk[i]} in batch"))
+    return results
+
+
+def _is_retryable(error: Optional[Exception]) -> bool:
+    return isinstance(error, HttpError) and getattr(error.resp, "status", None) in _RETRYABLE_STATUSES
@@ -1,20 +1,35 @@
 import os
 import base64
 import json
+import hashlib
+import logging
+import mimetypes
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional, Tuple, List
+from itertools import islice
+from typing import Callable, Optional, Tuple, List
 
 from flask import Blueprint, request, jsonify, redirect
 from dotenv import load_dotenv
 
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
-import requests
-
-from analyzer import generate_universal_caption
+from analyzer import generate_caption_from_bytes
+from gmail_clients import credentials_to_dict, gmail_clients
+from import_pipeline import StagedPipeline
+from http_session import supabase_request
+from metrics import IMPORT_ATTACHMENTS, count_bytes, stage_timer
+from import_jobs import ImportAlreadyRunning, ImportJob, import_jobs
+from gmail_fetch import (
+    GMAIL_BATCH_SIZE,
+    HistoryMessageSource,
+    batch_get_messages,
+    current_history_id,
+    history_checkpoint_expired,
+    iter_message_ids_with_fallback,
+)
 
 # Load environment variables
 ab_env_path = os.path.join(os.path.dirname(__file__), "ab.env")
@@ -27,6 +42,13 @@ GMAIL_CLIENT_SECRETS_FILE = os.environ.get("GMAIL_CLIENT_SECRETS_FILE", os.path.
 GMAIL_OAUTH_REDIRECT_URI = os.environ.get("GMAIL_OAUTH_REDIRECT_URI", "http://localhost:5000/api/gmail/callback")
 GMAIL_SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
+# Concurrency limits for the fetch / analyze / persist stages of /import
+GMAIL_IMPORT_FETCH_WORKERS = int(os.environ.get("GMAIL_IMPORT_FETCH_WORKERS", 4))
+GMAIL_IMPORT_ANALYZE_WORKERS = int(os.environ.get("GMAIL_IMPORT_ANALYZE_WORKERS", 4))
+GMAIL_IMPORT_PERSIST_WORKERS = int(os.environ.get("GMAIL_IMPORT_PERSIST_WORKERS", 4))
+# Rows buffered per bulk insert into the documents table
+GMAIL_IMPORT_INSERT_BATCH = int(os.environ.get("GMAIL_IMPORT_INSERT_BATCH", 50))
+
 # Supabase info (for server-side uploads and DB insert)
 SUPABASE_URL = os.environ.get("VITE_SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("VITE_SUPABASE_SERVICE_ROLE_KEY")
@@ -40,21 +62,22 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
 _token_store = {}
 
 gmail_bp = Blueprint('gmail', __name__)
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _client_config() -> dict:
+    """The OAuth client secrets, read from GMAIL_CLIENT_SECRETS_FILE once per process."""
+    with open(GMAIL_CLIENT_SECRETS_FILE, "r") as f:
+        return json.load(f)
 
 
-def _get_flow(state: Optional[str] = None) -> Flow:
-    flow = Flow.from_client_secrets_file(
-        GMAIL_CLIENT_SECRETS_FILE,
+def _get_flow() -> Flow:
+    return Flow.from_client_config(
+        _client_config(),
         scopes=GMAIL_SCOPES,
         redirect_uri=GMAIL_OAUTH_REDIRECT_URI,
     )
-    if state:
-        flow.fetch_token(state=state)
-    return flow
-
-
-def _build_service(creds: Credentials):
-    return build('gmail', 'v1', credentials=creds, cache_discovery=False)
 
 
 @gmail_bp.route('/auth-url', methods=['GET'])
@@ -68,11 +91,7 @@ def auth_url():
         if not user_id:
             return jsonify({"error": "Missing user_id"}), 400
 
-        flow = Flow.from_client_secrets_file(
-            GMAIL_CLIENT_SECRETS_FILE,
-            scopes=GMAIL_SCOPES,
-            redirect_uri=GMAIL_OAUTH_REDIRECT_URI,
-        )
+        flow = _get_flow()
         auth_url, state = flow.authorization_url(
             access_type='offline',
             include_granted_scopes='true',
@@ -118,23 +137,11 @@ def oauth_callback():
         if not state or not code or state not in _token_store:
             return jsonify({"error": "Invalid OAuth state or missing code"}), 400
 
-        flow = Flow.from_client_secrets_file(
-            GMAIL_CLIENT_SECRETS_FILE,
-            scopes=GMAIL_SCOPES,
-            redirect_uri=GMAIL_OAUTH_REDIRECT_URI,
-        )
+        flow = _get_flow()
         flow.fetch_token(code=code)
-        creds = flow.credentials
 
         # Store credentials in memory; in prod, store securely per user
-        _token_store[state]["credentials"] = {
-            "token": creds.token,
-            "refresh_token": creds.refresh_token,
-            "token_uri": creds.token_uri,
-            "client_id": creds.client_id,
-            "client_secret": creds.client_secret,
-            "scopes": creds.scopes,
-        }
+        _token_store[state]["credentials"] = credentials_to_dict(flow.credentials)
 
         # Close the popup/tab with a friendly message
         return (
@@ -198,226 +205,421 @@ def oauth_callback():
 @gmail_bp.route('/import', methods=['POST'])
 def import_attachments():
     """
-    Fetches recent messages with attachments from Gmail and uploads them to Supabase.
-    Body: { state: string, query?: string, max_results?: number }
-    Returns: { imported: number, details: [...]} where details has per-file info.
+    Starts a background job that fetches recent messages with attachments from Gmail and uploads them to Supabase.
+    Body: { state: string, query?: string, max_results?: number, mode?: "full" | "incremental" }
+    mode "incremental" only looks at messages added since the last import's Gmail historyId checkpoint,
+    falling back to a full query scan when there is no checkpoint yet or it has expired.
+    Returns 202: { job_id: string, status: "queued" }. Poll GET /import/<job_id> for progress and results.
+    Returns 409 with the running job's job_id while another import for the same user is still queued or running.
     """
     try:
         data = request.get_json(force=True)
         state = data.get('state')
         query = data.get('query', 'has:attachment newer_than:30d')  # Start with any attachments, not just unread
         max_results = int(data.get('max_results', 25))
+        incremental = data.get('mode', 'full') == 'incremental'
 
         if not state or state not in _token_store:
             return jsonify({"error": "Missing or invalid state. Authenticate first."}), 400
         entry = _token_store[state]
         user_id = entry.get('user_id')
-        cred_dict = entry.get('credentials')
-        if not cred_dict:
+        if not entry.get('credentials'):
             return jsonify({"error": "Not authorized yet. Complete OAuth flow."}), 400
 
-        creds = Credentials(
-            token=cred_dict.get('token'),
-            refresh_token=cred_dict.get('refresh_token'),
-            token_uri=cred_dict.get('token_uri'),
-            client_id=cred_dict.get('client_id'),
-            client_secret=cred_dict.get('client_secret'),
-            scopes=cred_dict.get('scopes'),
-        )
+        try:
+            job = import_jobs.submit(user_id, lambda job: _run_import(job, entry, query, max_results, incremental))
+        except ImportAlreadyRunning as e:
+            return jsonify({"error": str(e), "job_id": e.job.id, "status": e.job.status}), 409
+        return jsonify({"job_id": job.id, "status": job.status}), 202
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        service = _build_service(creds)
 
-        # List messages matching the query
-        messages = []
-        print(f"DEBUG: Searching Gmail with query: {query}")
-        print(f"DEBUG: User ID: {user_id}")
-        print(f"DEBUG: Max results: {max_results}")
+@gmail_bp.route('/import/<job_id>', methods=['GET'])
+def import_status(job_id: str):
+    """
+    Reports progress of an import job started via POST /import.
+    Query: state (same OAuth state used to start the import).
+    Returns: { job_id, status, error, progress: {...}, imported, details: [...] }.
+    details holds the per-file entries finished so far, and the full ordered list once status is "completed".
+    """
+    state = request.args.get('state')
+    if not state or state not in _token_store:
+        return jsonify({"error": "Missing or invalid state. Authenticate first."}), 400
+
+    job = import_jobs.get(job_id)
+    if job is None or job.user_id != _token_store[state].get('user_id'):
+        return jsonify({"error": "Unknown import job"}), 404
+    return jsonify(job.to_dict())
+
+
+def _run_import(job: ImportJob, entry: dict, query: str, max_results: int, incremental: bool) -> List[dict]:
+    """
+    Body of an import job: borrows the user's cached Gmail clients (one for listing, one per fetch worker)
+    and imports the messages with them.
+    """
+    user_id = entry.get('user_id')
+    cred_dict = entry['credentials']
+    with gmail_clients.client(user_id, cred_dict) as service, gmail_clients.per_thread(user_id, cred_dict) as get_service:
+        return _import_messages(job, entry, service, get_service, query, max_results, incremental)
+
 
+def _import_messages(job: ImportJob, entry: dict, service, get_service, query: str, max_results: int, incremental: bool) -> List[dict]:
+    """
+    Picks the message source (history since the stored checkpoint, or a query scan), runs the messages
+    through the import pipeline and stores the next historyId checkpoint on the token entry.
+    """
+    user_id = entry.get('user_id')
+
+    # Taken before scanning so messages arriving mid-import are picked up by the next incremental run
+    try:
+        checkpoint = current_history_id(service)
+    except Exception as e:
+        # Messages can still be listed; this run just won't advance the full-scan checkpoint
+        logger.warning("Could not read the Gmail historyId, keeping the previous checkpoint: %s", e)
+        checkpoint = None
+    history_source = None
+    if incremental and entry.get('history_id'):
         try:
-            resp = service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-            messages.extend(resp.get('messages', []))
-            print(f"DEBUG: Found {len(messages)} messages matching query")
-            print(f"DEBUG: Response keys: {list(resp.keys())}")
-            if 'nextPageToken' in resp:
-                print(f"DEBUG: Has next page token: {resp['nextPageToken']}")
+            history_source = HistoryMessageSource(service, entry['history_id'], max_results)
+            logger.info("Incremental sync from historyId %s", entry['history_id'])
         except Exception as e:
-            print(f"DEBUG: Error with main query: {e}")
-            messages = []
+            if not history_checkpoint_expired(e):
+                raise
+            logger.info("historyId %s expired, falling back to full scan", entry['history_id'])
+
+    if history_source is not None:
+        message_ids = iter(history_source)
+    else:
+        message_ids = _query_message_ids(service, query, max_results)
+
+    pipeline = StagedPipeline(
+        fetch_workers=GMAIL_IMPORT_FETCH_WORKERS,
+        analyze_workers=GMAIL_IMPORT_ANALYZE_WORKERS,
+        persist_workers=GMAIL_IMPORT_PERSIST_WORKERS,
+    )
+    claim_path, release_path = _path_claimer()
+    known_paths = _DuplicateIndex(user_id)
 
-        # Also try a broader search to see if there are any messages at all
-        if len(messages) == 0:
-            print("DEBUG: No messages found with unread query, trying broader search...")
-            
-            # Try different queries in order of preference
-            fallback_queries = [
-                'is:unread has:attachment',  # Unread with attachments (no date limit)
-                'has:attachment newer_than:7d',  # Any attachments in last 7 days
-                'has:attachment newer_than:30d', # Any attachments in last 30 days
-                'is:unread',  # Just unread messages
-                'has:attachment'  # Any messages with attachments
-            ]
-            
-            for fallback_query in fallback_queries:
-                try:
-                    print(f"DEBUG: Trying fallback query: '{fallback_query}'")
-                    fallback_resp = service.users().messages().list(userId='me', q=fallback_query, maxResults=10).execute()
-                    fallback_messages = fallback_resp.get('messages', [])
-                    print(f"DEBUG: Found {len(fallback_messages)} messages with query: '{fallback_query}'")
-                    
-                    if len(fallback_messages) > 0:
-                        print(f"DEBUG: Using fallback query results: '{fallback_query}'")
-                        messages = fallback_messages
-                        break
-                except Exception as e:
-                    print(f"DEBUG: Error with fallback query '{fallback_query}': {e}")
-                    continue
+    def report(detail: dict):
+        IMPORT_ATTACHMENTS.inc(status=detail.get("status") or "error")
+        job.add_detail(detail)
+
+    row_writer = _RowWriter(GMAIL_IMPORT_INSERT_BATCH, on_written=report)
+
+    analysis_memo = _AnalysisMemo()
+
+    def is_duplicate(storage_path: str) -> bool:
+        # Cheap pre-filter before download: already stored in Supabase (primed in bulk per chunk)
+        return known_paths.exists(storage_path)
+
+    def persist(item):
+        # Claimed only now, so an attachment that failed to download or analyze never blocks a same-named one
+        storage_path = item['storage_path']
+        if not claim_path(storage_path):
+            logger.debug("Skipping duplicate document %s", storage_path)
+            return {"filename": item['filename'], "status": "skipped_duplicate"}
+        try:
+            detail = _persist_attachment(user_id, item, row_writer)
+        except BaseException:
+            release_path(storage_path)
+            raise
+        if detail.get("status") == "upload_failed":
+            release_path(storage_path)
+        return detail
+
+    def fetch(source):
+        message_id, msg, error = source
+        job.message_scanned()
+        if error is not None:
+            raise error
+        return _fetch_message_attachments(get_service, user_id, message_id, msg, is_duplicate)
+
+    def analyze(item):
+        item = _analyze_attachment(item, analysis_memo)
+        job.attachment_analyzed()
+        return item
+
+    def on_detail(detail: dict):
+        # Imported files are reported by the row writer once their documents row is written (or fails)
+        if not row_writer.queued(detail):
+            report(detail)
+
+    # Message headers and part trees arrive in batched chunks as the pipeline pulls them;
+    # each chunk's candidate storage paths are checked against Supabase in one query
+    try:
+        details = pipeline.run(
+            _primed_sources(batch_get_messages(service, message_ids), known_paths),
+            fetch=fetch,
+            analyze=analyze,
+            persist=persist,
+            on_error=_pipeline_error_detail,
+            on_detail=on_detail,
+        )
+    finally:
+        # Files already uploaded to storage still get their rows if the message source fails mid-import
+        row_writer.flush()
+    imported_count = sum(1 for d in details if d.get("status") == "imported")
+    logger.info("Import completed. Total imported: %d, Total details: %d", imported_count, len(details))
+
+    # Keep the old checkpoint if anything failed, so the next incremental run retries those messages
+    if not any(d.get("error") or d.get("status") in ("upload_failed", "insert_failed") for d in details):
+        next_checkpoint = history_source.checkpoint() if history_source is not None else checkpoint
+        if next_checkpoint:
+            entry['history_id'] = next_checkpoint
+    return details
+
+
+def _query_message_ids(service, query: str, max_results: int):
+    """Full-scan message source: streams ids for the query, falling back to broader searches if it matches nothing."""
+    logger.info("Searching Gmail with query: %s (max results: %d)", query, max_results)
+    return iter_message_ids_with_fallback(
+        service, query, max_results,
+        fallback_queries=[
+            'is:unread has:attachment',  # Unread with attachments (no date limit)
+            'has:attachment newer_than:7d',  # Any attachments in last 7 days
+            'has:attachment newer_than:30d', # Any attachments in last 30 days
+            'is:unread',  # Just unread messages
+            'has:attachment'  # Any messages with attachments
+        ],
+        fallback_max_results=10,
+    )
+
+
+def _path_claimer():
+    """
+    Returns (claim, release). claim(path) -> bool is True only for the first claim of a storage path in this
+    import; release(path) gives the path up again after a failed upload. Persist workers run concurrently,
+    so two same-named attachments could otherwise both pass the duplicate check.
+    """
+    claimed = set()
+    lock = threading.Lock()
+
+    def claim(path: str) -> bool:
+        with lock:
+            if path in claimed:
+                return False
+            claimed.add(path)
+            return True
+
+    def release(path: str) -> None:
+        with lock:
+            claimed.discard(path)
 
-        details = []
-        imported_count = 0
+    return claim, release
 
-        for m in messages:
-            try:
-                print(f"DEBUG: Processing message {m['id']}")
-                msg = service.users().messages().get(userId='me', id=m['id']).execute()
+
+def _iter_attachment_parts(parts_list: List[dict], level: int = 0, log: bool = True):
+    """Yields (filename, attachment_id, mime_type) for each attachment part, including nested parts."""
+    indent = "  " * level
+    for part in parts_list:
+        filename = part.get('filename')
+        att_id = part.get('body', {}).get('attachmentId')
+        mime_type = part.get('mimeType')
+        sub_parts = part.get('parts', [])
+
+        if log:
+            logger.debug("%sPart - filename: %s, mimeType: %s, hasAttachmentId: %s, hasSubParts: %d",
+                         indent, filename, mime_type, bool(att_id), len(sub_parts))
+
+        if filename and att_id:
+            yield filename, att_id, mime_type
+        elif sub_parts:
+            yield from _iter_attachment_parts(sub_parts, level + 1, log)
+
+
+def _primed_sources(sources, known_paths: "_DuplicateIndex", chunk_size: int = GMAIL_BATCH_SIZE):
+    """
+    Passes (message_id, message, error) sources through unchanged, but first resolves the storage paths
+    of every attachment in each chunk against Supabase with a single query.
+    """
+    sources = iter(sources)
+    while True:
+        chunk = list(islice(sources, chunk_size))
+        if not chunk:
+            return
+        filenames = []
+        for _, msg, error in chunk:
+            if error is None and msg:
                 parts = (msg.get('payload', {}) or {}).get('parts', [])
-                subject = None
-                headers = msg.get('payload', {}).get('headers', [])
-                for h in headers:
-                    if h.get('name') == 'Subject':
-                        subject = h.get('value')
-                        break
-                
-                print(f"DEBUG: Message subject: {subject}")
-                print(f"DEBUG: Message has {len(parts)} parts")
-
-                # Traverse parts for attachments (including nested parts)
-                attachment_count = 0
-                
-                def process_parts(parts_list, level=0):
-                    nonlocal attachment_count
-                    indent = "  " * level
-                    for part in parts_list:
-                        filename = part.get('filename')
-                        body = part.get('body', {})
-                        att_id = body.get('attachmentId')
-                        mime_type = part.get('mimeType')
-                        sub_parts = part.get('parts', [])
-                        
-                        print(f"DEBUG: {indent}Part - filename: {filename}, mimeType: {mime_type}, hasAttachmentId: {bool(att_id)}, hasSubParts: {len(sub_parts)}")
-                        
-                        if filename and att_id:
-                            attachment_count += 1
-                            print(f"DEBUG: {indent}Found attachment: {filename} ({mime_type})")
-                        elif sub_parts:
-                            print(f"DEBUG: {indent}Processing {len(sub_parts)} sub-parts...")
-                            process_parts(sub_parts, level + 1)
-                
-                process_parts(parts)
-                print(f"DEBUG: Total attachments found in message: {attachment_count}")
-
-                # Now process each attachment for import
-                def process_attachments(parts_list):
-                    nonlocal imported_count
-                    for part in parts_list:
-                        filename = part.get('filename')
-                        body = part.get('body', {})
-                        att_id = body.get('attachmentId')
-                        mime_type = part.get('mimeType')
-                        sub_parts = part.get('parts', [])
-                        
-                        if filename and att_id:
-                            try:
-                                print(f"DEBUG: Processing attachment: {filename}")
-                                # Fetch attachment data
-                                att = service.users().messages().attachments().get(userId='me', messageId=m['id'], id=att_id).execute()
-                                data_b64 = att.get('data')
-                                if not data_b64:
-                                    print(f"DEBUG: No data for attachment {filename}")
-                                    continue
-
-                                file_bytes = base64.urlsafe_b64decode(data_b64)
-                                data_url = f"data:{mime_type};base64,{base64.b64encode(file_bytes).decode()}"
-
-                                # Analyze with Gemini
-                                print(f"DEBUG: Starting AI analysis for {filename}")
-                                try:
-                                    analysis = generate_universal_caption(data_url, filename)
-                                    print(f"DEBUG: AI analysis result: {analysis}")
-                                    
-                                    if 'error' in analysis:
-                                        print(f"DEBUG: AI analysis failed for {filename}: {analysis['error']}")
-                                        # Provide a fallback summary for image-only PDFs
-                                        if "image-only PDF" in analysis['error'] or "Could not extract any text" in analysis['error']:
-                                            summary = f"Scanned document: {filename} (requires manual review)"
-                                            department = "Unknown"
-                                        else:
-                                            summary = f"Analysis failed: {analysis['error']}"
-                                            department = "Unknown"
-                                    else:
-                                        summary = analysis.get('summary', 'No summary generated')
-                                        department = analysis.get('department', 'Unknown')
-                                        
-                                    print(f"DEBUG: Final summary: {summary}")
-                                    print(f"DEBUG: Final department: {department}")
-                                        
-                                except Exception as e:
-                                    print(f"DEBUG: Exception during AI analysis for {filename}: {e}")
-                                    summary = f"Analysis error: {str(e)}"
-                                    department = "Unknown"
-
-                                # Prepare storage path and check duplicates
-                                storage_path = f"{user_id}/{filename}"
-                                if _document_exists(user_id, storage_path):
-                                    details.append({
-                                        "filename": filename,
-                                        "status": "skipped_duplicate"
-                                    })
-                                    print(f"DEBUG: Skipping duplicate document {storage_path}")
-                                    continue
-
-                                # Upload to Supabase Storage using service role key
-                                upload_ok, public_url = _upload_to_supabase(storage_path, file_bytes, mime_type)
-                                if not upload_ok:
-                                    details.append({
-                                        "filename": filename,
-                                        "status": "upload_failed"
-                                    })
-                                    print(f"DEBUG: Upload failed for {filename}")
-                                    continue
-
-                                # Insert DB row
-                                _insert_db_row(user_id, filename, storage_path, mime_type, len(file_bytes), summary, department)
-
-                                imported_count += 1
-                                details.append({
-                                    "filename": filename,
-                                    "status": "imported",
-                                    "department": department,
-                                    "summary": summary
-                                })
-                                print(f"DEBUG: Successfully imported {filename}")
-                            except Exception as e:
-                                print(f"DEBUG: Error processing attachment {filename}: {e}")
-                                details.append({
-                                    "filename": filename,
-                                    "status": "error",
-                                    "error": str(e)
-                                })
-                        elif sub_parts:
-                            process_attachments(sub_parts)
-                
-                process_attachments(parts)
-
-            except HttpError as he:
-                details.append({"message_id": m.get('id'), "error": str(he)})
-            except Exception as ex:
-                details.append({"message_id": m.get('id'), "error": str(ex)})
-
-        print(f"DEBUG: Import completed. Total imported: {imported_count}, Total details: {len(details)}")
-        return jsonify({"imported": imported_count, "details": details})
+                filenames.extend(filename for filename, _, _ in _iter_attachment_parts(parts, log=False))
+        known_paths.prime(filenames)
+        yield from chunk
+
+
+def _fetch_message_attachments(get_service, user_id: str, message_id: str, msg: dict, is_duplicate) -> List[dict]:
+    """
+    Fetch stage: downloads the data of each attachment in an already-loaded message.
+    Attachments already stored in Supabase are skipped before any data is downloaded.
+    """
+    logger.debug("Processing message %s", message_id)
+    service = get_service()
+    payload = msg.get('payload', {}) or {}
+    parts = payload.get('parts', [])
+    subject = None
+    for h in payload.get('headers', []):
+        if h.get('name') == 'Subject':
+            subject = h.get('value')
+            break
+
+    logger.debug("Message subject: %s, %d parts", subject, len(parts))
+
+    items = []
+    for filename, att_id, mime_type in _iter_attachment_parts(parts):
+        storage_path = f"{user_id}/{filename}"
+        if is_duplicate(storage_path):
+            logger.debug("Skipping duplicate document %s", storage_path)
+            items.append({"detail": {"filename": filename, "status": "skipped_duplicate"}})
+            continue
+
+        try:
+            with stage_timer("gmail_attachment"):
+                att = service.users().messages().attachments().get(userId='me', messageId=message_id, id=att_id).execute()
+        except Exception as e:
+            logger.warning("Error fetching attachment %s: %s", filename, e)
+            items.append({"detail": {"filename": filename, "status": "error", "error": str(e)}})
+            continue
+
+        data_b64 = att.get('data')
+        if not data_b64:
+            logger.warning("No data for attachment %s", filename)
+            continue
+
+        file_bytes = base64.urlsafe_b64decode(data_b64)
+        count_bytes("gmail_attachment", len(file_bytes))
+        items.append({
+            "message_id": message_id,
+            "filename": filename,
+            "mime_type": mime_type,
+            "storage_path": storage_path,
+            "file_bytes": file_bytes,
+        })
+
+    logger.debug("Total attachments found in message: %d", len(items))
+    return items
+
+
+def _analyze_attachment(item: dict, memo: "_AnalysisMemo") -> dict:
+    """
+    Analyze stage: runs Gemini on the attachment and records summary/department on the item.
+    Identical content within one import (same bytes and file type) is analyzed only once; the summary
+    text is built per attachment, since fallback summaries name the file.
+    """
+    filename = item['filename']
+    key = (hashlib.sha256(item['file_bytes']).hexdigest(), mimetypes.guess_type(filename)[0])
+    analysis = memo.get_or_run(key, lambda: _run_analysis(item))
+    item['summary'], item['department'] = _summarize_analysis(filename, analysis)
+    return item
+
+
+def _run_analysis(item: dict) -> dict:
+    """
+    Returns the analyzer's result dict for an attachment. An exception from the analyzer is returned
+    as {"error": ..., "raised": True}; a retryable failure raises RetryableAnalysisError.
+    """
+    filename = item['filename']
+    # Prefer the type implied by the filename (as for uploads); Gmail often reports application/octet-stream
+    mime_type = mimetypes.guess_type(filename)[0] or item['mime_type']
 
+    logger.debug("Starting AI analysis for %s", filename)
+    try:
+        analysis = generate_caption_from_bytes(item['file_bytes'], filename, mime_type=mime_type)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        logger.exception("Exception during AI analysis for %s: %s", filename, e)
+        return {"error": str(e), "raised": True}
+    logger.debug("AI analysis result: %s", analysis)
+
+    if analysis.get('retryable'):
+        # Don't import with a placeholder summary; fail this file so a later import retries it
+        raise RetryableAnalysisError(analysis['error'])
+    return analysis
+
+
+def _summarize_analysis(filename: str, analysis: dict) -> Tuple[str, str]:
+    """Returns (summary, department) for an attachment, turning analysis failures into a readable summary."""
+    if analysis.get('raised'):
+        summary = f"Analysis error: {analysis['error']}"
+        department = "Unknown"
+    elif 'error' in analysis:
+        logger.warning("AI analysis failed for %s: %s", filename, analysis['error'])
+        # Provide a fallback summary for image-only PDFs
+        if "image-only PDF" in analysis['error'] or "Could not extract any text" in analysis['error']:
+            summary = f"Scanned document: {filename} (requires manual review)"
+            department = "Unknown"
+        else:
+            summary = f"Analysis failed: {analysis['error']}"
+            department = "Unknown"
+    else:
+        summary = analysis.get('summary', 'No summary generated')
+        department = analysis.get('department', 'Unknown')
+
+    logger.debug("Final summary: %s", summary)
+    logger.debug("Final department: %s", department)
+    return summary, department
+
+
+class RetryableAnalysisError(Exception):
+    """Analysis could not run for a temporary reason (e.g. Gemini quota); the file should be retried later."""
+
+
+class _AnalysisMemo:
+    """Shares one analysis result between attachments with identical content in the same import."""
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get_or_run(self, key, fn):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if not owner:
+            logger.debug("Reusing analysis of identical attachment content")
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+def _persist_attachment(user_id: str, item: dict, row_writer: "_RowWriter") -> dict:
+    """Persist stage: uploads to Supabase Storage and queues the documents row for bulk insert."""
+    filename = item['filename']
+    mime_type = item['mime_type']
+    file_bytes = item['file_bytes']
+    storage_path = item['storage_path']
+
+    # Upload to Supabase Storage using service role key
+    upload_ok, public_url = _upload_to_supabase(storage_path, file_bytes, mime_type)
+    if not upload_ok:
+        logger.warning("Upload failed for %s", filename)
+        return {"filename": filename, "status": "upload_failed"}
+
+    detail = {
+        "filename": filename,
+        "status": "imported",
+        "department": item['department'],
+        "summary": item['summary']
+    }
+    # Insert DB row (buffered; written in bulk)
+    row_writer.add(_document_row(user_id, filename, storage_path, mime_type, len(file_bytes), item['summary'], item['department']), detail)
+
+    logger.debug("Successfully imported %s", filename)
+    return detail
+
+
+def _pipeline_error_detail(stage: str, payload, exc: Exception) -> dict:
+    """Turns an exception raised inside a pipeline stage into the per-message/per-file detail entry."""
+    if stage == "fetch":
+        return {"message_id": payload[0], "error": str(exc)}
+    logger.warning("Error processing attachment %s: %s", payload.get('filename'), exc)
+    return {"filename": payload.get('filename'), "status": "error", "error": str(exc)}
 
 
 def _upload_to_supabase(path: str, content: bytes, mime: str) -> Tuple[bool, Optional[str]]:
@@ -430,23 +632,17 @@ def _upload_to_supabase(path: str, content: bytes, mime: str) -> Tuple[bool, Opt
         "Content-Type": mime,
         "x-upsert": "true",
     }
-    r = requests.post(url, headers=headers, data=content)
-    if r.status_code in (200, 201):
-        return True, None
-    return False, None
+    with stage_timer("supabase_upload") as stage:
+        r = supabase_request("POST", url, headers=headers, data=content)
+        if r.status_code not in (200, 201):
+            stage.outcome = "error"
+            return False, None
+    count_bytes("supabase_upload", len(content))
+    return True, None
 
 
-def _insert_db_row(user_id: str, name: str, path: str, mime_type: str, size_bytes: int, ai_summary: str, department: str):
-    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-        return False
-    url = f"{SUPABASE_URL}/rest/v1/documents"
-    headers = {
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal",
-    }
-    payload = {
+def _document_row(user_id: str, name: str, path: str, mime_type: str, size_bytes: int, ai_summary: str, department: str) -> dict:
+    return {
         "user_id": user_id,
         "name": name,
         "path": path,
@@ -456,8 +652,27 @@ def _insert_db_row(user_id: str, name: str, path: str, mime_type: str, size_byte
         "department": department,
         "is_read": False,
     }
-    r = requests.post(url, headers=headers, data=json.dumps(payload))
-    return r.status_code in (200, 201)
+
+
+def _insert_db_rows(rows: List[dict]) -> bool:
+    """Inserts many documents rows with one bulk POST of a JSON array."""
+    if not rows:
+        return True
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        return False
+    url = f"{SUPABASE_URL}/rest/v1/documents"
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+        "apikey": SUPABASE_SERVICE_ROLE_KEY,
+        "Content-Type": "application/json",
+        "Prefer": "return=minimal",
+    }
+    with stage_timer("supabase_insert") as stage:
+        r = supabase_request("POST", url, headers=headers, data=json.dumps(rows))
+        ok = r.status_code in (200, 201)
+        if not ok:
+            stage.outcome = "error"
+    return ok
 
 
 def _document_exists(user_id: str, storage_path: str) -> bool:
@@ -476,17 +691,140 @@ def _document_exists(user_id: str, storage_path: str) -> bool:
         "apikey": SUPABASE_SERVICE_ROLE_KEY,
     }
     try:
-        resp = requests.get(url, headers=headers, params=params)
+        with stage_timer("supabase_dup_check") as stage:
+            resp = supabase_request("GET", url, headers=headers, params=params)
+            if resp.status_code != 200:
+                stage.outcome = "error"
         if resp.status_code != 200:
-            print(f"DEBUG: _document_exists query failed: {resp.status_code} {resp.text}")
+            logger.warning("_document_exists query failed: %s %s", resp.status_code, resp.text)
             return False
         rows = resp.json()
         return isinstance(rows, list) and len(rows) > 0
     except Exception as e:
-        print(f"DEBUG: _document_exists exception: {e}")
+        logger.warning("_document_exists exception: %s", e)
         return False
 
 
+# Storage paths per path=in.(...) duplicate query, to keep query URLs to a sane length
+_IN_QUERY_CHUNK = 50
+
+
+def _existing_document_paths(user_id: str, storage_paths: List[str]) -> set:
+    """Returns which of storage_paths already have a documents row for this user, using path=in.(...) queries."""
+    if not storage_paths or not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        return set()
+    url = f"{SUPABASE_URL}/rest/v1/documents"
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+        "apikey": SUPABASE_SERVICE_ROLE_KEY,
+    }
+    existing = set()
+    for i in range(0, len(storage_paths), _IN_QUERY_CHUNK):
+        chunk = storage_paths[i:i + _IN_QUERY_CHUNK]
+        params = {
+            "user_id": f"eq.{user_id}",
+            "path": f"in.({','.join(_postgrest_quote(p) for p in chunk)})",
+            "select": "path",
+        }
+        with stage_timer("supabase_dup_check"):
+            resp = supabase_request("GET", url, headers=headers, params=params)
+            if resp.status_code != 200:
+                raise RuntimeError(f"duplicate check failed: {resp.status_code} {resp.text}")
+        existing.update(row.get("path") for row in resp.json())
+    return existing
+
+
+def _postgrest_quote(value: str) -> str:
+    """Quotes a value for a PostgREST in.(...) list, since paths may contain commas or parentheses."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class _DuplicateIndex:
+    """
+    Per-import view of which storage paths already exist in Supabase.
+    prime() resolves a whole batch of candidate paths with one query; exists() falls back to a
+    single-path lookup for anything that was not primed (or whose batch query failed).
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._known = {}
+        self._lock = threading.Lock()
+
+    def prime(self, filenames: List[str]) -> None:
+        with self._lock:
+            paths = list(dict.fromkeys(f"{self.user_id}/{f}" for f in filenames if f"{self.user_id}/{f}" not in self._known))
+        if not paths:
+            return
+        try:
+            existing = _existing_document_paths(self.user_id, paths)
+        except Exception as e:
+            logger.warning("Bulk duplicate check failed, falling back to per-file checks: %s", e)
+            return
+        with self._lock:
+            for path in paths:
+                self._known[path] = path in existing
+
+    def exists(self, storage_path: str) -> bool:
+        with self._lock:
+            known = self._known.get(storage_path)
+        if known is None:
+            known = _document_exists(self.user_id, storage_path)
+            with self._lock:
+                self._known[storage_path] = known
+        return known
+
+
+class _RowWriter:
+    """
+    Buffers documents rows from concurrent persist workers and writes them with one bulk insert per batch.
+    If a bulk insert fails, the matching details are marked "insert_failed". on_written(detail), if given,
+    is called for each detail once its batch has been written.
+    """
+
+    def __init__(self, batch_size: int, on_written: Optional[Callable[[dict], None]] = None):
+        self.batch_size = max(1, batch_size)
+        self.on_written = on_written
+        self._pending = []
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def queued(self, detail: dict) -> bool:
+        """True if detail was handed to add(), i.e. its outcome is reported through on_written."""
+        with self._lock:
+            return id(detail) in self._queued
+
+    def add(self, row: dict, detail: dict) -> None:
+        with self._lock:
+            self._queued.add(id(detail))
+            self._pending.append((row, detail))
+            if len(self._pending) < self.batch_size:
+                return
+            batch, self._pending = self._pending, []
+        self._write(batch)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, []
+        self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        if not batch:
+            return
+        try:
+            ok = _insert_db_rows([row for row, _ in batch])
+        except Exception as e:
+            logger.exception("Bulk insert raised: %s", e)
+            ok = False
+        if not ok:
+            logger.error("Bulk insert of %d rows failed", len(batch))
+            for _, detail in batch:
+                detail["status"] = "insert_failed"
+        if self.on_written:
+            for _, detail in batch:
+                self.on_written(detail)
+
+
 # Add this new endpoint for testing
 @gmail_bp.route('/test-search', methods=['POST'])
 def test_gmail_search():
@@ -504,17 +842,6 @@ def test_gmail_search():
         if not cred_dict:
             return jsonify({"error": "Not authorized yet. Complete OAuth flow."}), 400
 
-        creds = Credentials(
-            token=cred_dict.get('token'),
-            refresh_token=cred_dict.get('refresh_token'),
-            token_uri=cred_dict.get('token_uri'),
-            client_id=cred_dict.get('client_id'),
-            client_secret=cred_dict.get('client_secret'),
-            scopes=cred_dict.get('scopes'),
-        )
-
-        service = _build_service(creds)
-        
         # Test different queries
         test_queries = [
             'has:attachment newer_than:30d',
@@ -526,18 +853,19 @@ def test_gmail_search():
         ]
         
         results = {}
-        for test_query in test_queries:
-            try:
-                resp = service.users().messages().list(userId='me', q=test_query, maxResults=5).execute()
-                message_count = len(resp.get('messages', []))
-                results[test_query] = {
-                    'count': message_count,
-                    'messages': resp.get('messages', [])[:2]  # First 2 message IDs
-                }
-                print(f"DEBUG: Query '{test_query}' found {message_count} messages")
-            except Exception as e:
-                results[test_query] = {'error': str(e)}
-                print(f"DEBUG: Query '{test_query}' failed: {e}")
+        with gmail_clients.client(entry.get('user_id'), cred_dict) as service:
+            for test_query in test_queries:
+                try:
+                    resp = service.users().messages().list(userId='me', q=test_query, maxResults=5).execute()
+                    message_count = len(resp.get('messages', []))
+                    results[test_query] = {
+                        'count': message_count,
+                        'messages': resp.get('messages', [])[:2]  # First 2 message IDs
+                    }
+                    logger.info("Query '%s' found %d messages", test_query, message_count)
+                except Exception as e:
+                    results[test_query] = {'error': str(e)}
+                    logger.warning("Query '%s' failed: %s", test_query, e)
         
         return jsonify({"results": results})
         
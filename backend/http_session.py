@@ -0,0 +1,106 @@
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connection pool and timeout settings for calls to Supabase Storage and REST
+SUPABASE_POOL_SIZE = int(os.environ.get("SUPABASE_POOL_SIZE", 16))
+SUPABASE_CONNECT_TIMEOUT = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", 5))
+SUPABASE_READ_TIMEOUT = float(os.environ.get("SUPABASE_READ_TIMEOUT", 60))
+SUPABASE_MAX_RETRIES = int(os.environ.get("SUPABASE_MAX_RETRIES", 3))
+SUPABASE_RETRY_BACKOFF = float(os.environ.get("SUPABASE_RETRY_BACKOFF", 0.5))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_request_count = 0
+_error_count = 0
+
+
+# Statuses that mean the request was not processed, so even a non-idempotent POST (e.g. a bulk insert)
+# can be resent; a 500/502/504 may arrive after PostgREST already committed the rows
+_POST_RETRY_STATUSES = frozenset({429, 503})
+
+
+class _SupabaseRetry(Retry):
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "POST" and status_code not in _POST_RETRY_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session() -> requests.Session:
+    retry = _SupabaseRetry(
+        total=SUPABASE_MAX_RETRIES,
+        connect=SUPABASE_MAX_RETRIES,
+        # A read error means the server may already have acted on the request; don't resend it
+        read=0,
+        status=SUPABASE_MAX_RETRIES,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+        backoff_factor=SUPABASE_RETRY_BACKOFF,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SUPABASE_POOL_SIZE, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def supabase_session() -> requests.Session:
+    """Returns the process-wide keep-alive session shared by all Supabase helpers."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def supabase_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Sends a request through the shared session with default (connect, read) timeouts.
+    Retries with exponential backoff on connection errors and 429/5xx responses happen inside the adapter.
+    """
+    global _request_count, _error_count
+    kwargs.setdefault("timeout", (SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT))
+    with _stats_lock:
+        _request_count += 1
+    try:
+        return supabase_session().request(method, url, **kwargs)
+    except requests.RequestException:
+        with _stats_lock:
+            _error_count += 1
+        raise
+
+
+def pool_stats() -> dict:
+    """
+    Connection reuse counters for the shared session. urllib3 counts requests and new connections
+    per host pool; the difference is how many requests rode on an existing keep-alive connection.
+    """
+    connections = 0
+    pooled_requests = 0
+    session = _session
+    if session is not None:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                pooled_requests += pool.num_requests
+    with _stats_lock:
+        return {
+            "requests": _request_count,
+            "errors": _error_count,
+            "connections_opened": connections,
+            "connections_reused": max(0, pooled_requests - connections),
+            "pool_size": SUPABASE_POOL_SIZE,
+        }
@@ -0,0 +1,101 @@
+import os
+import logging
+import threading
+from io import BytesIO
+from typing import BinaryIO
+
+from PIL import Image, ImageOps, ImageStat
+
+from metrics import count_bytes, stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Uploaded images are normalized before they are sent to Gemini: rotated per EXIF, downsampled to
+# IMAGE_MAX_DIMENSION on the longest side, and re-encoded as JPEG (grayscale for document-like images)
+IMAGE_PREPROCESS_ENABLED = os.environ.get("IMAGE_PREPROCESS_ENABLED", "true").lower() not in ("0", "false", "no")
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", 2048))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+# Mean saturation (0-255) below which an image is treated as a document scan and sent in grayscale
+IMAGE_GRAYSCALE_MAX_SATURATION = int(os.environ.get("IMAGE_GRAYSCALE_MAX_SATURATION", 24))
+
+_EXIF_ORIENTATION = 0x0112
+# Formats Gemini accepts as-is; an upload already within limits may be sent untouched if that is smaller
+_PASSTHROUGH_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+_stats_lock = threading.Lock()
+_images = 0
+_bytes_before = 0
+_bytes_after = 0
+
+
+def prepare_image(stream: BinaryIO, mime_type: str, max_dimension: int = IMAGE_MAX_DIMENSION) -> dict:
+    """
+    Returns the uploaded image in stream as an inline blob ({"mime_type", "data"}) ready for Gemini.
+    JPEGs are decoded in draft mode directly at a reduced scale, so large phone photos never fully
+    decode. When the upload needs no rotation or resizing and is smaller than the re-encoded version,
+    the original bytes are sent instead.
+    """
+    global _images, _bytes_before, _bytes_after
+    stream.seek(0)
+    before = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+
+    with stage_timer("image_preprocess"), Image.open(stream) as img:
+        original_size = img.size
+        upright = img.getexif().get(_EXIF_ORIENTATION, 1) == 1
+        if img.format == "JPEG":
+            img.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(img)
+        image.thumbnail((max_dimension, max_dimension))
+        blob = encode_image(image)
+
+    if upright and max(original_size) <= max_dimension and mime_type in _PASSTHROUGH_TYPES and before <= len(blob["data"]):
+        stream.seek(0)
+        blob = {"mime_type": mime_type, "data": stream.read()}
+
+    with _stats_lock:
+        _images += 1
+        _bytes_before += before
+        _bytes_after += len(blob["data"])
+    count_bytes("image_preprocess", before)
+    logger.debug("Image preprocessed %dx%d %d bytes -> %d bytes", original_size[0], original_size[1], before, len(blob["data"]))
+    return blob
+
+
+def encode_image(image: Image.Image, quality: int = IMAGE_JPEG_QUALITY) -> dict:
+    """Re-encodes image as JPEG, in grayscale when it looks like a document, and returns it as an inline blob."""
+    image = _flatten_alpha(image)
+    image = image.convert("L" if _is_document_like(image) else "RGB")
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    return {"mime_type": "image/jpeg", "data": out.getvalue()}
+
+
+def _flatten_alpha(image: Image.Image) -> Image.Image:
+    """
+    JPEG has no alpha channel and convert() would simply drop it, turning dark text on a transparent
+    background into a black page. Transparent images are composited onto white instead.
+    """
+    if image.mode not in ("RGBA", "LA", "PA") and "transparency" not in image.info:
+        return image
+    rgba = image.convert("RGBA")
+    background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, rgba).convert("RGB")
+
+
+def _is_document_like(image: Image.Image) -> bool:
+    """Scans of printed notices and circulars are nearly colourless; photos are not."""
+    if image.mode in ("1", "L", "LA", "I", "I;16", "F"):
+        return True
+    sample = image.convert("RGB").resize((64, 64)).convert("HSV")
+    return ImageStat.Stat(sample).mean[1] < IMAGE_GRAYSCALE_MAX_SATURATION
+
+
+def preprocess_stats() -> dict:
+    with _stats_lock:
+        return {
+            "images": _images,
+            "bytes_before": _bytes_before,
+            "bytes_after": _bytes_after,
+            "bytes_saved": _bytes_before - _bytes_after,
+        }
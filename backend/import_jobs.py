@@ -0,0 +1,150 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How many imports may run at once, and how long finished jobs stay pollable
+GMAIL_IMPORT_JOB_WORKERS = int(os.environ.get("GMAIL_IMPORT_JOB_WORKERS", 2))
+GMAIL_IMPORT_JOB_TTL_SECONDS = int(os.environ.get("GMAIL_IMPORT_JOB_TTL_SECONDS", 3600))
+
+
+class ImportJob:
+    """Progress and result of one background Gmail import. All updates go through the job lock."""
+
+    def __init__(self, user_id: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.messages_scanned = 0
+        self.attachments_analyzed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.failed = 0
+        self.details: List[dict] = []
+        self._lock = threading.Lock()
+
+    def message_scanned(self) -> None:
+        with self._lock:
+            self.messages_scanned += 1
+
+    def attachment_analyzed(self) -> None:
+        with self._lock:
+            self.attachments_analyzed += 1
+
+    def add_detail(self, detail: dict) -> None:
+        """Records a finished per-file (or per-message) detail as soon as it is known."""
+        with self._lock:
+            self.details.append(detail)
+            self._count(detail)
+
+    def _count(self, detail: dict) -> None:
+        status = detail.get("status")
+        if status == "imported":
+            self.imported += 1
+        elif status == "skipped_duplicate":
+            self.skipped += 1
+        else:
+            self.failed += 1
+
+    def start(self) -> None:
+        with self._lock:
+            self.status = "running"
+
+    def finish(self, details: List[dict]) -> None:
+        """Replaces the partial details with the final, ordered list and recounts outcomes from it."""
+        with self._lock:
+            self.details = list(details)
+            # Statuses can still change after a detail is first reported (e.g. a failed bulk insert)
+            self.imported = self.skipped = self.failed = 0
+            for detail in self.details:
+                self._count(detail)
+            self.status = "completed"
+            self.finished_at = time.time()
+
+    def fail(self, error: str) -> None:
+        with self._lock:
+            self.status = "failed"
+            self.error = error
+            self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "progress": {
+                    "messages_scanned": self.messages_scanned,
+                    "attachments_analyzed": self.attachments_analyzed,
+                    "imported": self.imported,
+                    "skipped": self.skipped,
+                    "failed": self.failed,
+                },
+                "imported": self.imported,
+                "details": list(self.details),
+            }
+
+
+class ImportAlreadyRunning(Exception):
+    """The user already has a queued or running import; job is that import."""
+
+    def __init__(self, job: ImportJob):
+        super().__init__(f"Import {job.id} is already {job.status} for this user")
+        self.job = job
+
+
+class ImportJobRunner:
+    """Runs import jobs on a fixed worker pool so the web worker can return immediately."""
+
+    def __init__(self, max_workers: int, ttl_seconds: int):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="import-job")
+        self._ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, ImportJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user_id: Optional[str], fn: Callable[[ImportJob], List[dict]]) -> ImportJob:
+        """
+        Schedules fn(job); its return value becomes the job's final details.
+        Raises ImportAlreadyRunning while another job for the same user is unfinished: concurrent imports
+        would each pass the duplicate checks, store the same files twice and race on the history checkpoint.
+        """
+        job = ImportJob(user_id)
+        with self._lock:
+            self._purge_expired()
+            if user_id is not None:
+                for other in self._jobs.values():
+                    if other.user_id == user_id and other.finished_at is None:
+                        raise ImportAlreadyRunning(other)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def _run(job: ImportJob, fn: Callable[[ImportJob], List[dict]]) -> None:
+        job.start()
+        try:
+            job.finish(fn(job))
+        except Exception as e:
+            logger.exception("Import job %s failed: %s", job.id, e)
+            job.fail(str(e))
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        expired = [jid for jid, j in self._jobs.items() if j.finished_at and now - j.finished_at > self._ttl_seconds]
+        for jid in expired:
+            del self._jobs[jid]
+
+
+import_jobs = ImportJobRunner(GMAIL_IMPORT_JOB_WORKERS, GMAIL_IMPORT_JOB_TTL_SECONDS)
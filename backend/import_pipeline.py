@@ -0,0 +1,104 @@
+import concurrent.futures as cf
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class StagedPipeline:
+    """
+    Runs sources through fetch -> analyze -> persist stages, each on its own bounded thread pool,
+    so network waits in one stage overlap with work in the others.
+
+    - fetch(source) returns a list of item dicts for that source.
+    - analyze(item) returns the (updated) item.
+    - persist(item) returns the final detail dict for the item.
+    An item that already carries a "detail" key is finished and skips the remaining stages.
+    If a stage raises, on_error(stage, payload, exc) supplies the detail instead.
+    on_detail(detail), if given, is called from the coordinating thread as each detail is recorded.
+
+    Details are returned in source order (then item order), regardless of completion order.
+    """
+
+    def __init__(self, fetch_workers: int = 4, analyze_workers: int = 4, persist_workers: int = 4,
+                 max_pending: Optional[int] = None):
+        self.fetch_workers = max(1, fetch_workers)
+        self.analyze_workers = max(1, analyze_workers)
+        self.persist_workers = max(1, persist_workers)
+        # Caps how many fetched items (and their file bytes) may wait for analysis/persist at once
+        self.max_pending = max_pending or (self.analyze_workers + self.persist_workers) * 2
+
+    def run(self,
+            sources: Iterable[Any],
+            fetch: Callable[[Any], List[dict]],
+            analyze: Callable[[dict], dict],
+            persist: Callable[[dict], dict],
+            on_error: Callable[[str, Any, Exception], Optional[dict]],
+            on_detail: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        results: Dict[Tuple[int, int], dict] = {}
+        pending: Dict[cf.Future, Tuple[str, Tuple[int, int], Any]] = {}
+        source_iter = enumerate(sources)
+        exhausted = False
+        fetches_in_flight = 0
+        items_in_flight = 0
+
+        with cf.ThreadPoolExecutor(self.fetch_workers, thread_name_prefix="import-fetch") as fetch_pool, \
+                cf.ThreadPoolExecutor(self.analyze_workers, thread_name_prefix="import-analyze") as analyze_pool, \
+                cf.ThreadPoolExecutor(self.persist_workers, thread_name_prefix="import-persist") as persist_pool:
+
+            while True:
+                # Pull new sources only while downstream stages have room, to bound memory
+                while not exhausted and fetches_in_flight < self.fetch_workers and items_in_flight < self.max_pending:
+                    try:
+                        idx, source = next(source_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[fetch_pool.submit(fetch, source)] = ("fetch", (idx, -1), source)
+                    fetches_in_flight += 1
+
+                if not pending:
+                    break
+
+                done, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                for fut in done:
+                    stage, key, payload = pending.pop(fut)
+                    try:
+                        value = fut.result()
+                        error = None
+                    except Exception as e:
+                        value = None
+                        error = e
+
+                    if stage == "fetch":
+                        fetches_in_flight -= 1
+                        if error is not None:
+                            self._record(results, key, on_error(stage, payload, error), on_detail)
+                            continue
+                        for j, item in enumerate(value or []):
+                            item_key = (key[0], j)
+                            if "detail" in item:
+                                self._record(results, item_key, item["detail"], on_detail)
+                                continue
+                            pending[analyze_pool.submit(analyze, item)] = ("analyze", item_key, item)
+                            items_in_flight += 1
+
+                    elif stage == "analyze":
+                        if error is not None or "detail" in value:
+                            items_in_flight -= 1
+                            detail = on_error(stage, payload, error) if error is not None else value["detail"]
+                            self._record(results, key, detail, on_detail)
+                            continue
+                        pending[persist_pool.submit(persist, value)] = ("persist", key, value)
+
+                    else:
+                        items_in_flight -= 1
+                        detail = on_error(stage, payload, error) if error is not None else value
+                        self._record(results, key, detail, on_detail)
+
+        return [results[k] for k in sorted(results)]
+
+    @staticmethod
+    def _record(results: Dict[Tuple[int, int], dict], key: Tuple[int, int], detail: Optional[dict],
+                on_detail: Optional[Callable[[dict], None]]) -> None:
+        if detail is not None:
+            results[key] = detail
+            if on_detail is not None:
+                on_detail(detail)
@@ -0,0 +1,118 @@
+import re
+import json
+import hashlib
+from typing import Dict, List, Tuple
+
+# Priority rules from the analysis prompt: any of these makes a document High priority,
+# and counts strongly towards the department it is listed under
+HIGH_PRIORITY_KEYWORDS = {
+    "Safety & Security": ["accident", "derailment", "collision", "fire", "safety audit", "security breach",
+                          "unavoidable delays", "service disruption"],
+    "Legal": ["legal notice", "lawsuit", "court order", "compliance violation"],
+    "Finance": ["audit objection", "financial loss", "fraud", "tender irregularity"],
+    "Operations": ["emergency maintenance", "system failure", "power outage", "signal failure"],
+}
+
+DEPARTMENT_KEYWORDS = {
+    "HR": ["recruitment", "payroll", "salary", "appraisal", "promotion", "transfer order", "employee", "attendance",
+           "leave application", "pension", "training programme"],
+    "IT": ["software", "server", "network", "cyber", "password", "email account", "data backup", "laptop"],
+    "Finance": ["invoice", "budget", "payment", "reimbursement", "expenditure", "GST", "bank guarantee",
+                "financial statement"],
+    "Operations": ["train service", "timetable", "rolling stock", "station", "maintenance schedule", "headway",
+                   "depot", "ridership"],
+    "Legal": ["contract", "agreement", "arbitration", "litigation", "affidavit", "legal opinion"],
+    "Safety & Security": ["safety", "security", "CCTV", "evacuation", "fire drill", "hazard"],
+    "Procurement": ["tender", "purchase order", "quotation", "vendor", "procurement", "bid", "request for proposal"],
+}
+
+_HIGH_PRIORITY_WEIGHT = 3
+_SUMMARY_CHARS = 500
+
+
+def _normalize(keyword: str) -> str:
+    return " ".join(keyword.lower().split())
+
+
+class KeywordClassifier:
+    """
+    Assigns priority and department from keyword hits in a single pass over the text.
+    All keywords are compiled into one case-insensitive alternation (longest first, on word
+    boundaries), so scanning costs the same however many keyword lists there are.
+    """
+
+    def __init__(self, high_priority: Dict[str, List[str]], departments: Dict[str, List[str]]):
+        self._lookup: Dict[str, Tuple[str, bool]] = {}
+        for department, keywords in departments.items():
+            for keyword in keywords:
+                self._lookup[_normalize(keyword)] = (department, False)
+        for department, keywords in high_priority.items():
+            for keyword in keywords:
+                self._lookup[_normalize(keyword)] = (department, True)
+
+        # Multi-word keywords match across any run of whitespace, including line breaks from PDF extraction
+        alternation = "|".join(
+            r"\s+".join(re.escape(word) for word in keyword.split())
+            for keyword in sorted(self._lookup, key=len, reverse=True)
+        )
+        self._pattern = re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE)
+        # Changes whenever the rules do, so cached results classified under older rules are not reused
+        rules = json.dumps(sorted((k, d, p) for k, (d, p) in self._lookup.items()))
+        self.version = hashlib.sha256(rules.encode()).hexdigest()[:16]
+
+    def classify(self, text: str) -> dict:
+        """
+        Returns {"department", "priority", "keywords", "high_priority_keywords", "score"}. Department is the
+        one with the most weighted hits ("Unknown" without any); priority is High on any high-priority keyword,
+        Medium when some department keyword matched and Low otherwise. score is the department's weight
+        counting each distinct keyword once, so a single word repeated throughout a document stays at 1.
+        """
+        scores: Dict[str, int] = {}
+        distinct_scores: Dict[str, int] = {}
+        keywords = []
+        high_priority = []
+        for match in self._pattern.finditer(text):
+            keyword = _normalize(match.group(0))
+            department, is_high = self._lookup[keyword]
+            weight = _HIGH_PRIORITY_WEIGHT if is_high else 1
+            scores[department] = scores.get(department, 0) + weight
+            if keyword not in keywords:
+                keywords.append(keyword)
+                distinct_scores[department] = distinct_scores.get(department, 0) + weight
+                if is_high:
+                    high_priority.append(keyword)
+
+        if high_priority:
+            priority = "High"
+        elif scores:
+            priority = "Medium"
+        else:
+            priority = "Low"
+        department = max(scores, key=scores.get) if scores else "Unknown"
+        return {
+            "department": department,
+            "priority": priority,
+            "keywords": keywords,
+            "high_priority_keywords": high_priority,
+            "score": distinct_scores.get(department, 0),
+        }
+
+
+def local_result(text: str, classification: dict) -> dict:
+    """An analysis result built without the model: an extractive summary plus the keyword classification."""
+    summary = " ".join(text[:_SUMMARY_CHARS * 2].split())
+    if len(summary) > _SUMMARY_CHARS:
+        summary = summary[:_SUMMARY_CHARS].rsplit(" ", 1)[0] + "..."
+    if classification["high_priority_keywords"]:
+        action = f"Immediate review required: mentions {', '.join(classification['high_priority_keywords'][:3])}"
+    else:
+        action = "Review required"
+    return {
+        "summary": summary,
+        "department": classification["department"],
+        "priority": classification["priority"],
+        "action_required": action,
+    }
+
+
+keyword_classifier = KeywordClassifier(HIGH_PRIORITY_KEYWORDS, DEPARTMENT_KEYWORDS)
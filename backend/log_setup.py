@@ -0,0 +1,59 @@
+import os
+import time
+import logging
+import threading
+
+# Log level for the backend's own loggers, and how many records with the same message template
+# may be emitted per LOG_RATE_LIMIT_WINDOW seconds before further ones are dropped
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", 20))
+LOG_RATE_LIMIT_WINDOW = float(os.environ.get("LOG_RATE_LIMIT_WINDOW", 60))
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per message template (logger name + unformatted message) per
+    window. Per-attachment messages use %-style arguments, so they share a template and a single busy
+    import cannot flood the log. The first record after a window reports how many were dropped.
+    """
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, count, dropped = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                if dropped:
+                    record.msg = f"{record.msg} [{dropped} similar messages suppressed]"
+                started, count, dropped = now, 0, 0
+            if count >= self.limit:
+                self._windows[key] = (started, count, dropped + 1)
+                return False
+            self._windows[key] = (started, count + 1, dropped)
+            return True
+
+
+_configured = False
+
+
+def configure_logging() -> None:
+    """Sets up leveled, rate-limited console logging once per process."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_LIMIT_WINDOW))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
@@ -0,0 +1,145 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds, spanning Supabase round trips up to long-document Gemini calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in values)
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, one series per label combination."""
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts..., count, sum]
+                series = self._series[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(values[-1])}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("kmrl_stage_duration_seconds", "Time spent per call of a processing stage.")
+STAGE_TOTAL = Counter("kmrl_stage_calls_total", "Calls of a processing stage by outcome.")
+STAGE_BYTES = Counter("kmrl_stage_bytes_total", "Bytes handled by a processing stage.")
+ANALYSIS_RESULTS = Counter("kmrl_analysis_results_total", "Document analyses by where the answer came from.")
+IMPORT_ATTACHMENTS = Counter("kmrl_gmail_import_attachments_total", "Gmail import outcomes per attachment or message.")
+
+_METRICS = [STAGE_SECONDS, STAGE_TOTAL, STAGE_BYTES, ANALYSIS_RESULTS, IMPORT_ATTACHMENTS]
+
+
+class _StageObservation:
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[_StageObservation]:
+    """
+    Times the enclosed block as one call of stage. An exception marks the call as an error;
+    the block can also set `.outcome` on the yielded object (e.g. "error" for a failed HTTP status).
+    """
+    observation = _StageObservation()
+    started = time.perf_counter()
+    try:
+        yield observation
+    except BaseException:
+        observation.outcome = "error"
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        STAGE_TOTAL.inc(stage=stage, outcome=observation.outcome)
+
+
+def count_bytes(stage: str, amount: int) -> None:
+    STAGE_BYTES.inc(amount, stage=stage)
+
+
+def render_gauges(prefix: str, values: dict, help: str) -> List[str]:
+    """Renders the numeric entries of a stats dict (as returned by the *_stats() helpers) as gauges."""
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"])
+    return lines
+
+
+def render_metrics(extra_lines: Optional[List[str]] = None) -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines or [])
+    return "\n".join(lines) + "\n"
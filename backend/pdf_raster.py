@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator
+
+import pdf2image
+from PIL import Image
+
+# Scanned (image-only) PDFs: how many leading pages to rasterize, at what resolution, and the longest
+# side (in pixels) page images are downsampled to before they are sent to Gemini
+SCANNED_PDF_MAX_PAGES = int(os.environ.get("SCANNED_PDF_MAX_PAGES", 10))
+SCANNED_PDF_DPI = int(os.environ.get("SCANNED_PDF_DPI", 150))
+SCANNED_PDF_MAX_DIMENSION = int(os.environ.get("SCANNED_PDF_MAX_DIMENSION", 1600))
+SCANNED_PDF_RASTER_THREADS = int(os.environ.get("SCANNED_PDF_RASTER_THREADS", min(4, os.cpu_count() or 1)))
+
+
+def iter_pdf_page_images(stream: BinaryIO, first_page: int = 1, last_page: int = SCANNED_PDF_MAX_PAGES,
+                         dpi: int = SCANNED_PDF_DPI, max_dimension: int = SCANNED_PDF_MAX_DIMENSION) -> Iterator[Image.Image]:
+    """
+    Yields downsampled page images for pages first_page..last_page of the PDF in stream, in page order.
+    pdftoppm renders the range into a temporary folder (split across SCANNED_PDF_RASTER_THREADS processes)
+    and only file paths come back, so at most one full-resolution page is decoded in memory at a time.
+    JPEG draft mode lets the decoder skip straight to a reduced scale before the final resize.
+    """
+    stream.seek(0)
+    with tempfile.TemporaryDirectory(prefix="scanned-pdf-") as folder:
+        pdf_path = os.path.join(folder, "input.pdf")
+        with open(pdf_path, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        stream.seek(0)
+
+        paths = pdf2image.convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=folder,
+            fmt="jpeg",
+            paths_only=True,
+            thread_count=max(1, SCANNED_PDF_RASTER_THREADS),
+        )
+        for path in paths:
+            with Image.open(path) as page:
+                page.draft("RGB", (max_dimension, max_dimension))
+                page.thumbnail((max_dimension, max_dimension))
+                page.load()
+                image = page.copy()
+            os.remove(path)
+            yield image
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Optional
+
+import pypdf
+
+# PDFs with at least this many pages (and bytes) are extracted across a process pool; smaller ones in-process
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 24))
+PDF_PARALLEL_MIN_BYTES = int(os.environ.get("PDF_PARALLEL_MIN_BYTES", 1024 * 1024))
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", os.cpu_count() or 2))
+# Pages handed to a worker per task; each task re-opens the file, so very small ranges waste parsing
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared extraction pool, created on first use. Workers are spawned rather than forked:
+    the server process runs threads and gRPC channels, neither of which survives a fork safely.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=max(1, PDF_EXTRACT_WORKERS),
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    """Worker task: text of pages [start, stop) of the PDF at path."""
+    reader = pypdf.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def iter_pdf_pages(stream: BinaryIO, max_chars: Optional[int] = None) -> Iterator[str]:
+    """
+    Yields the text of each page of the PDF in stream, in page order, as soon as it is extracted.
+    Large PDFs are extracted by the process pool with a bounded number of page ranges in flight, so
+    pages are still yielded in order and nothing far past the consumer's position is extracted.
+    With max_chars, extraction stops once that many characters have been produced (the last page is
+    trimmed to fit), and closing the generator early cancels any work that has not started.
+    """
+    stream.seek(0)
+    reader = pypdf.PdfReader(stream)
+    page_count = len(reader.pages)
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+
+    if page_count >= PDF_PARALLEL_MIN_PAGES and size >= PDF_PARALLEL_MIN_BYTES and PDF_EXTRACT_WORKERS > 1:
+        pages = _iter_parallel(stream, page_count)
+    else:
+        pages = (page.extract_text() or "" for page in reader.pages)
+
+    remaining = max_chars
+    try:
+        for text in pages:
+            if remaining is not None:
+                text = text[:remaining]
+                remaining -= len(text)
+            yield text
+            if remaining is not None and remaining <= 0:
+                return
+    finally:
+        pages.close()
+
+
+def _iter_parallel(stream: BinaryIO, page_count: int) -> Iterator[str]:
+    # Workers read the PDF from a temporary file rather than receiving its bytes with every task
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        shutil.copyfileobj(stream, tmp)
+        path = tmp.name
+    stream.seek(0)
+
+    pool = _get_pool()
+    ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    pending = deque()
+
+    def submit_next():
+        start = next(ranges, None)
+        if start is not None:
+            pending.append(pool.submit(_extract_range, path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+
+    try:
+        for _ in range(max(1, PDF_EXTRACT_WORKERS) * 2):
+            submit_next()
+        while pending:
+            texts = pending.popleft().result()
+            submit_next()
+            yield from texts
+    finally:
+        for future in pending:
+            future.cancel()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
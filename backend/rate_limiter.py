@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+# Errors worth retrying: quota/rate limiting plus transient server-side failures
+_RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+_TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return isinstance(error, _RATE_LIMIT_ERRORS)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket limiter over two budgets, requests per minute and tokens per minute, with retry.
+
+    The refill rate starts at the configured budgets and adapts AIMD-style: every 429 halves it
+    (down to min_fraction of the budget) and every success nudges it back up, so throughput settles
+    just under the real quota. Buckets hold burst_seconds worth of budget to smooth out bursts.
+    Usable from threads (call) and from the async engine (acall); both share the same buckets.
+    """
+
+    def __init__(self, rpm: float, tpm: float, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                 min_fraction: float = 0.1, increase_step: float = 0.02, burst_seconds: float = 10.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_fraction = min_fraction
+        self.increase_step = increase_step
+        self.burst_seconds = burst_seconds
+        self.fraction = 1.0
+        self._lock = threading.Lock()
+        self._request_tokens = self._request_capacity()
+        self._token_tokens = self._token_capacity()
+        self._updated = time.monotonic()
+        self.calls = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+    def _request_capacity(self) -> float:
+        return max(1.0, self.rpm * self.fraction * self.burst_seconds / 60)
+
+    def _token_capacity(self) -> float:
+        return max(1.0, self.tpm * self.fraction * self.burst_seconds / 60)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._request_tokens = min(self._request_capacity(), self._request_tokens + elapsed * self.rpm * self.fraction / 60)
+        self._token_tokens = min(self._token_capacity(), self._token_tokens + elapsed * self.tpm * self.fraction / 60)
+
+    def _reserve(self, tokens: int) -> float:
+        """Takes one request and `tokens` tokens if available; otherwise returns how long to wait before retrying."""
+        with self._lock:
+            self._refill(time.monotonic())
+            # A single request larger than the bucket would never fit; let it through once the bucket is full
+            tokens = min(tokens, self._token_capacity())
+            if self._request_tokens >= 1 and self._token_tokens >= tokens:
+                self._request_tokens -= 1
+                self._token_tokens -= tokens
+                return 0.0
+            wait_requests = (1 - self._request_tokens) * 60 / (self.rpm * self.fraction)
+            wait_tokens = (tokens - self._token_tokens) * 60 / (self.tpm * self.fraction)
+            return max(wait_requests, wait_tokens, 0.01)
+
+    def acquire(self, tokens: int = 0) -> None:
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self.wait_seconds += wait
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        while True:
+            wait = self._reserve(tokens)
+            if wait <= 0:
+                return
+            self.wait_seconds += wait
+            await asyncio.sleep(wait)
+
+    def _on_success(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self.fraction = min(1.0, self.fraction + self.increase_step)
+
+    def _on_rate_limited(self) -> None:
+        with self._lock:
+            self.rate_limited += 1
+            self.fraction = max(self.min_fraction, self.fraction / 2)
+            # Drop any saved-up burst so the next calls are paced at the reduced rate
+            self._request_tokens = min(self._request_tokens, 0.0)
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        if is_rate_limit_error(error):
+            self._on_rate_limited()
+        elif not isinstance(error, _TRANSIENT_ERRORS):
+            return False
+        if attempt >= self.max_retries:
+            return False
+        with self._lock:
+            self.retries += 1
+        return True
+
+    def call(self, fn: Callable[[], Any], tokens: int = 0) -> Any:
+        """Runs fn() under the rate limit, retrying 429s and transient errors with jittered backoff."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            self._on_success()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], tokens: int = 0) -> Any:
+        """Async variant of call(); fn must return a new awaitable on each invocation."""
+        attempt = 0
+        while True:
+            await self.acquire_async(tokens)
+            try:
+                result = await fn()
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            self._on_success()
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "current_fraction": round(self.fraction, 3),
+                "calls": self.calls,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+
+_gemini_limiter: Optional[AdaptiveRateLimiter] = None
+_gemini_limiter_lock = threading.Lock()
+
+
+def get_gemini_limiter() -> AdaptiveRateLimiter:
+    """
+    Returns the process-wide limiter shared by every Gemini call (uploads, batches and Gmail imports).
+    Created lazily so ab.env has already been loaded by the time we read the settings.
+    """
+    global _gemini_limiter
+    if _gemini_limiter is None:
+        with _gemini_limiter_lock:
+            if _gemini_limiter is None:
+                _gemini_limiter = AdaptiveRateLimiter(
+                    rpm=float(os.environ.get("GEMINI_RPM", 60)),
+                    tpm=float(os.environ.get("GEMINI_TPM", 1_000_000)),
+                    max_retries=int(os.environ.get("GEMINI_MAX_RETRIES", 5)),
+                    base_delay=float(os.environ.get("GEMINI_RETRY_BASE_DELAY", 1.0)),
+                    max_delay=float(os.environ.get("GEMINI_RETRY_MAX_DELAY", 30.0)),
+                )
+    return _gemini_limiter
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import BinaryIO, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Bumped whenever the shape or validation of cached results changes, so older entries are never served
+# (2: results validated against the structured-output schema instead of scraped from free text)
+CACHE_FORMAT_VERSION = 2
+
+
+def make_cache_key(file_data: Union[bytes, memoryview, BinaryIO], mime_type: str, prompt: str, model_name: str,
+                   variant: str = "") -> str:
+    """
+    Build a cache key from the decoded file content and everything that changes the model's answer.
+    variant covers settings outside the model call that still shape the result (e.g. local classification).
+    file_data may be bytes-like, or a seekable binary stream that is hashed in chunks and rewound.
+    Each component is length-prefixed so different splits of the same bytes can never collide.
+    """
+    h = hashlib.sha256()
+    h.update(CACHE_FORMAT_VERSION.to_bytes(4, "big"))
+    for part in (model_name.encode(), mime_type.encode(), prompt.encode(), variant.encode()):
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+
+    if hasattr(file_data, "read"):
+        start = file_data.tell()
+        size = file_data.seek(0, os.SEEK_END) - start
+        file_data.seek(start)
+        h.update(size.to_bytes(8, "big"))
+        for chunk in iter(lambda: file_data.read(_HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+        file_data.seek(start)
+    else:
+        h.update(memoryview(file_data).nbytes.to_bytes(8, "big"))
+        h.update(file_data)
+    return h.hexdigest()
+
+
+class DiskResultCache:
+    """
+    Persistent analysis-result cache stored as one JSON file per entry.
+    Entries expire after ttl_seconds; when the directory grows past max_bytes the
+    least recently used entries (by file mtime) are removed first.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int, max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("stored_at", 0) > self.ttl_seconds:
+            self._remove(path)
+            return None
+
+        try:
+            # Bump mtime so eviction treats this entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get("result")
+
+    def set(self, key: str, result: dict) -> None:
+        """Stores result under key. A full or read-only cache disk is logged and the entry is skipped."""
+        path = self._path(key)
+        payload = json.dumps({"stored_at": time.time(), "result": result}).encode("utf-8")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique per write, so concurrent writers in other worker processes never share a temp file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        except OSError as e:
+            logger.warning("Could not write analysis cache entry: %s", e)
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            old_size = self._file_size(path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self._remove(tmp_path)
+            logger.warning("Could not write analysis cache entry: %s", e)
+            return
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(payload) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            for path, _, _ in self._entries():
+                self._remove(path)
+            self._size = 0
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _scan_size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _evict(self) -> None:
+        """Drop expired entries, then oldest-used ones until we are back under 90% of max_bytes."""
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, mtime, size in entries:
+            if total <= target and now - mtime <= self.ttl_seconds:
+                continue
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache: Optional[DiskResultCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[DiskResultCache]:
+    """
+    Returns the process-wide cache configured from the environment, or None if disabled.
+    The cache directory and limits are read on first use rather than at import time.
+    """
+    global _default_cache
+    if os.environ.get("ANALYSIS_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                try:
+                    _default_cache = DiskResultCache(
+                        directory=os.environ.get("ANALYSIS_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".analysis_cache")),
+                        ttl_seconds=int(os.environ.get("ANALYSIS_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+                        max_bytes=int(os.environ.get("ANALYSIS_CACHE_MAX_BYTES", 50 * 1024 * 1024)),
+                    )
+                except OSError as e:
+                    # An unusable cache directory must not break analysis; results are simply not cached
+                    logger.warning("Analysis cache disabled: %s", e)
+                    return None
+    return _default_cache
@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gmail_fetch  # noqa: E402
+
+_BOUNDARY = "batch_test"
+
+
+def _batch_response(parts):
+    """A multipart/mixed batch reply; parts is a list of (request_id, status, body)."""
+    lines = []
+    for request_id, status, body in parts:
+        lines += [
+            f"--{_BOUNDARY}",
+            "Content-Type: application/http",
+            f"Content-ID: <response-batch + {request_id}>",
+            "",
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+            "Content-Type: application/json",
+            "",
+            json.dumps(body),
+        ]
+    lines.append(f"--{_BOUNDARY}--")
+    headers = {"status": "200", "content-type": f"multipart/mixed; boundary={_BOUNDARY}"}
+    return headers, "\r\n".join(lines).encode()
+
+
+def _message(message_id):
+    return {"id": message_id, "payload": {"headers": [], "parts": []}}
+
+
+def _service(responses):
+    # The Gmail discovery document ships with google-api-python-client, so only the batch calls are mocked
+    return build("gmail", "v1", http=HttpMockSequence(responses), static_discovery=True)
+
+
+@mock.patch.object(gmail_fetch.time, "sleep", lambda seconds: None)
+class BatchGetMessagesTest(unittest.TestCase):
+    def test_returns_messages_in_order(self):
+        service = _service([_batch_response([("0", 200, _message("m0")), ("1", 200, _message("m1"))])])
+
+        results = list(gmail_fetch.batch_get_messages(service, ["m0", "m1"]))
+
+        self.assertEqual([(mid, msg["id"], err) for mid, msg, err in results], [("m0", "m0", None), ("m1", "m1", None)])
+
+    def test_retries_rate_limited_parts_only(self):
+        service = _service([
+            _batch_response([("0", 200, _message("m0")), ("1", 429, {"error": {"message": "rate limited"}})]),
+            _batch_response([("1", 200, _message("m1"))]),
+        ])
+
+        results = list(gmail_fetch.batch_get_messages(service, ["m0", "m1"]))
+
+        self.assertEqual([(mid, msg["id"], err) for mid, msg, err in results], [("m0", "m0", None), ("m1", "m1", None)])
+
+    def test_retries_failed_batch_request(self):
+        service = _service([
+            ({"status": "503"}, b"backend error"),
+            _batch_response([("0", 200, _message("m0")), ("1", 200, _message("m1"))]),
+        ])
+
+        results = list(gmail_fetch.batch_get_messages(service, ["m0", "m1"]))
+
+        self.assertEqual([msg["id"] for _, msg, _ in results], ["m0", "m1"])
+
+    def test_persistent_batch_failure_is_recorded_per_message(self):
+        service = _service([({"status": "503"}, b"backend error")] * (gmail_fetch.GMAIL_BATCH_MAX_RETRIES + 1))
+
+        results = list(gmail_fetch.batch_get_messages(service, ["m0", "m1"]))
+
+        self.assertEqual([mid for mid, _, _ in results], ["m0", "m1"])
+        for _, msg, err in results:
+            self.assertIsNone(msg)
+            self.assertIsInstance(err, HttpError)
+
+
+if __name__ == "__main__":
+    unittest.main()
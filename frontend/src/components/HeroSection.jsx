@@ -6,7 +6,7 @@ import { User, Paperclip, Send, Inbox, Image as ImageIcon, UploadCloud, Users, C
 import { useAuth } from "@/hooks/use-auth"; 
 import { Link, useNavigate, useLocation } from "react-router-dom";
 import { useState, useRef, useEffect } from "react";
-import { apiService, fileToBase64 } from "@/lib/api";
+import { apiService } from "@/lib/api";
 
 //=================================================================
 // HEADER COMPONENT (No changes)
@@ -133,9 +133,7 @@ const HeroSection = () => {
     try {
       setIsUploading(true);
       setMessage("Analyzing document...");
-      const base64 = await fileToBase64(selectedFile);
-      
-      const response = await apiService.analyzeDocument(base64, selectedFile.name, promptText.trim() || undefined);
+      const response = await apiService.analyzeDocumentFile(selectedFile, selectedFile.name, promptText.trim() || undefined);
       const cleanSummary = sanitizeSummary(response?.summary);
       const detectedDepartment = response?.department || "Unknown";
       
@@ -32,6 +32,93 @@ export const apiService = {
     }
   },
 
+  // Analyze a File/Blob sent as multipart/form-data (no base64 inflation)
+  async analyzeDocumentFile(file, filename, prompt) {
+    try {
+      const form = new FormData();
+      form.append('file', file, filename);
+      form.append('filename', filename);
+      if (prompt) form.append('prompt', prompt);
+
+      const response = await fetch(`${API_BASE_URL}/analyze-document`, {
+        method: 'POST',
+        body: form,
+      });
+
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || 'Failed to analyze document');
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error('Error analyzing document:', error);
+      throw error;
+    }
+  },
+
+  // Analyze a File/Blob over Server-Sent Events; onSummary receives summary text chunks as they are generated
+  async analyzeDocumentStream(file, filename, prompt, { onSummary } = {}) {
+    const form = new FormData();
+    form.append('file', file, filename);
+    form.append('filename', filename);
+    if (prompt) form.append('prompt', prompt);
+
+    const response = await fetch(`${API_BASE_URL}/analyze-document/stream`, {
+      method: 'POST',
+      body: form,
+    });
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.error || 'Failed to analyze document');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const message = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = message.match(/^event: (.*)$/m)?.[1];
+        const data = JSON.parse(message.match(/^data: (.*)$/m)?.[1] || '{}');
+
+        if (event === 'summary') onSummary?.(data.text);
+        else if (event === 'result') return data;
+        else if (event === 'error') throw new Error(data.error || 'Failed to analyze document');
+      }
+    }
+    throw new Error('Analysis stream ended without a result');
+  },
+
+  // Analyze many Files at once; resolves to one result per file, in order ({ success, ...fields } or { success: false, error })
+  async analyzeDocumentsBatch(files, { prompt, concurrency, batchSize = 50 } = {}) {
+    const results = [];
+    for (let i = 0; i < files.length; i += batchSize) {
+      const form = new FormData();
+      files.slice(i, i + batchSize).forEach((file) => form.append('files', file, file.name));
+      if (prompt) form.append('prompt', prompt);
+      if (concurrency) form.append('concurrency', String(concurrency));
+
+      const response = await fetch(`${API_BASE_URL}/analyze-documents`, {
+        method: 'POST',
+        body: form,
+      });
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.error || 'Failed to analyze documents');
+      }
+      const data = await response.json();
+      results.push(...data.results);
+    }
+    return results;
+  },
+
   // Gmail: get OAuth URL
   async getGmailAuthUrl(userId) {
     const url = new URL(`${API_BASE_URL}/gmail/auth-url`);
@@ -41,17 +128,39 @@ export const apiService = {
     return res.json();
   },
 
-  // Gmail: import attachments after OAuth callback
-  async importFromGmail(state, { query = 'has:attachment newer_than:30d', maxResults = 25 } = {}) {
+  // Gmail: import attachments after OAuth callback.
+  // The backend runs the import as a background job; poll it until it finishes.
+  async importFromGmail(state, { query = 'has:attachment newer_than:30d', maxResults = 25, pollIntervalMs = 2000, onProgress } = {}) {
     const res = await fetch(`${API_BASE_URL}/gmail/import`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ state, query, max_results: maxResults }),
     });
-    if (!res.ok) {
+    // 409: an import for this user is already running; follow that job instead of starting another
+    if (!res.ok && res.status !== 409) {
       const err = await res.json().catch(() => ({}));
       throw new Error(err.error || 'Gmail import failed');
     }
+    const { job_id: jobId } = await res.json();
+
+    for (;;) {
+      const job = await this.getGmailImportStatus(state, jobId);
+      if (onProgress) onProgress(job);
+      if (job.status === 'completed') return job;
+      if (job.status === 'failed') throw new Error(job.error || 'Gmail import failed');
+      await new Promise((resolve) => setTimeout(resolve, pollIntervalMs));
+    }
+  },
+
+  // Gmail: progress of a background import job
+  async getGmailImportStatus(state, jobId) {
+    const url = new URL(`${API_BASE_URL}/gmail/import/${jobId}`);
+    url.searchParams.set('state', state);
+    const res = await fetch(url.toString());
+    if (!res.ok) {
+      const err = await res.json().catch(() => ({}));
+      throw new Error(err.error || 'Failed to get Gmail import status');
+    }
     return res.json();
   },
 
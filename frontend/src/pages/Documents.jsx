@@ -290,16 +290,6 @@ const Documents = () => {
         }
     };
 
-    // Convert Blob to DataURL (base64) string
-    const blobToDataUrl = async (blob) => {
-        return new Promise((resolve, reject) => {
-            const reader = new FileReader();
-            reader.onload = () => resolve(reader.result);
-            reader.onerror = reject;
-            reader.readAsDataURL(blob);
-        });
-    };
-
     // Generate or refresh AI summary for a document
     const onSummarize = async (item) => {
         const rowId = item.id ?? item.path;
@@ -315,16 +305,13 @@ const Documents = () => {
             if (!res.ok) throw new Error("Failed to download file for analysis.");
             const blob = await res.blob();
 
-            // 3) Convert to base64 data URL
-            const dataUrl = await blobToDataUrl(blob);
-
-            // 4) Call backend to analyze
-            const result = await apiService.analyzeDocument(dataUrl, item.name || "document");
+            // 3) Call backend to analyze
+            const result = await apiService.analyzeDocumentFile(blob, item.name || "document");
 
             const newSummary = result?.summary || "";
             const newDepartment = result?.department || item.department || null;
 
-            // 5) Persist to Supabase
+            // 4) Persist to Supabase
             const { supabase } = await import("@/integrations/supabase/client");
             const { error: upErr } = await supabase
                 .from("documents")
@@ -332,10 +319,10 @@ const Documents = () => {
                 .eq("id", item.id);
             if (upErr) throw upErr;
 
-            // 6) Update UI state
+            // 5) Update UI state
             setItems((prev) => prev.map((it) => (it.id === item.id ? { ...it, ai_summary: newSummary, department: newDepartment } : it)));
 
-            // 7) Show dialog with the latest summary
+            // 6) Show dialog with the latest summary
             setActiveSummary({ title: item.name, summary: newSummary });
         } catch (e) {
             setError(e?.message || "Failed to summarize document.");
@@ -4,7 +4,7 @@ import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Dialog, DialogContent, DialogFooter, DialogHeader, DialogTitle } from "@/components/ui/dialog";
 import { useNavigate } from "react-router-dom";
-import { apiService, fileToBase64 } from "@/lib/api";
+import { apiService } from "@/lib/api";
 import { UploadCloud, Loader2, Inbox } from "lucide-react";
 import BackButton from "@/components/BackButton";
 
@@ -37,22 +37,28 @@ const GetStarted = () => {
         const { supabase } = await import("@/integrations/supabase/client");
         const { STORAGE_BUCKET } = await import("@/lib/storage");
         
-        for (const f of selectedFiles) {
-          const fileData = await fileToBase64(f);
-          
+        // Analyze all selected files in one concurrent batch request
+        let analyses = [];
+        try {
+          analyses = await apiService.analyzeDocumentsBatch(selectedFiles);
+        } catch (aiError) {
+          console.warn("AI batch analysis failed, using fallback:", aiError);
+        }
+
+        for (const [index, f] of selectedFiles.entries()) {
           let aiSummary = "";
           let detectedDepartment = department || "Unknown";
           let detectedPriority = "Medium";
           let actionRequired = "Review required";
           
-          try {
-            const analysis = await apiService.analyzeDocument(fileData, f.name);
+          const analysis = analyses[index];
+          if (analysis?.success) {
             aiSummary = analysis.summary || "";
             detectedDepartment = analysis.department || department || "Unknown";
             detectedPriority = analysis.priority || "Medium";
             actionRequired = analysis.action_required || "Review required";
-          } catch (aiError) {
-            console.warn("AI analysis failed, using fallback:", aiError);
+          } else {
+            console.warn("AI analysis failed, using fallback:", analysis?.error);
             aiSummary = `Document: ${f.name}`;
           }
           